@@ -0,0 +1,40 @@
+import time
+from collections import OrderedDict
+from copy import copy
+from threading import Lock
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram.constants import AUTH_TOKEN_VERSION
+from foodgram.versioning import peek_version
+
+_tokens = OrderedDict()
+_lock = Lock()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кешем токен -> пользователь
+       в памяти процесса. Кеш ограничен по размеру и времени жизни
+       записей. Запись токена устаревает во всех воркерах при смене
+       его версии: выходе, смене пароля, деактивации или удалении
+       пользователя. Версия читается до загрузки пользователя,
+       поэтому изменение во время загрузки не останется в кеше
+    """
+
+    def authenticate_credentials(self, key):
+        version = peek_version(AUTH_TOKEN_VERSION.format(key))
+        now = time.monotonic()
+        with _lock:
+            entry = _tokens.get(key)
+            if entry is not None and entry[2] > now and entry[3] == version:
+                _tokens.move_to_end(key)
+                return copy(entry[0]), entry[1]
+        user, token = super().authenticate_credentials(key)
+        with _lock:
+            _tokens[key] = (
+                user, token, now + settings.AUTH_TOKEN_CACHE_TTL, version)
+            _tokens.move_to_end(key)
+            while len(_tokens) > settings.AUTH_TOKEN_CACHE_SIZE:
+                _tokens.popitem(last=False)
+        return copy(user), token
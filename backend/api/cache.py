@@ -0,0 +1,123 @@
+import gzip
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from foodgram.versioning import get_version
+
+
+class AnonymousResponseCacheMixin:
+    """Кэш ответов list и retrieve для анонимных пользователей.
+       Ключ включает версии данных, поэтому любое изменение
+       делает старые ответы недоступными. Пока один воркер
+       вычисляет ответ, остальные ждут его в кэше.
+    """
+
+    cache_versions = ()
+    cache_query_params = ()
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
+    cache_lock_timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    cache_poll_interval = 0.05
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request, **kwargs):
+        """Ключ из версий данных и нормализованных параметров запроса"""
+        params = request.query_params
+        if not set(params) <= set(self.cache_query_params):
+            return None
+        query = '&'.join(
+            f'{name}={value}' for name in sorted(params)
+            for value in sorted(params.getlist(name)))
+        versions = ':'.join(
+            get_version(name) for name in self.cache_versions)
+        raw_key = (f'{versions}|{self.action}|{request.scheme}|'
+                   f'{request.get_host()}|{sorted(kwargs.items())}|{query}')
+        return f'response:{self.basename}:{md5(raw_key.encode()).hexdigest()}'
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        key = None
+        if request.user.is_anonymous:
+            key = self.get_cache_key(request, **kwargs)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        lock = f'{key}:lock'
+        locked = cache.add(lock, True, self.cache_lock_timeout)
+        if not locked:
+            deadline = time.monotonic() + self.cache_lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.cache_poll_interval)
+                data = cache.get(key)
+                if data is not None:
+                    return Response(data)
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, self.cache_timeout)
+        finally:
+            if locked:
+                cache.delete(lock)
+        return response
+
+
+class PrecomputedListMixin:
+    """Готовый JSON и его gzip-копия для неизменяемых справочников.
+       Собираются один раз на версию данных; ETag совпадает с версией,
+       поэтому ответ 304 не требует обращения к базе. У gzip-копии
+       свой ETag: строгий валидатор различает представления.
+    """
+
+    payload_version = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # У каждого вьюсета свои готовые ответы
+        cls._payloads = {}
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        version = get_version(self.payload_version)
+        gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        etag = f'{self.payload_version}-{version}'
+        etag = f'"{etag}-gzip"' if gzipped else f'"{etag}"'
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in parse_etags(if_none_match) or if_none_match == '*':
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            body, compressed = self.get_payload(version)
+            response = HttpResponse(body, content_type='application/json')
+            if gzipped:
+                response.content = compressed
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def get_payload(self, version):
+        """Готовые байты ответа для версии данных"""
+        payload_version, body, compressed = self._payloads.get(
+            self.payload_version, (None, None, None))
+        if payload_version != version:
+            serializer = self.get_serializer(self.get_queryset(), many=True)
+            body = JSONRenderer().render(serializer.data)
+            compressed = gzip.compress(body)
+            self._payloads[self.payload_version] = (version, body, compressed)
+        return body, compressed
@@ -1,6 +1,7 @@
 from django_filters.rest_framework import FilterSet, filters
 
 from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.search import search_recipes
 
 
 class IngredientFilter(FilterSet):
@@ -25,10 +26,15 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'), ('trending', 'В тренде')),
+        method='get_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
 
     def get_is_favorited(self, queryset, name, value):
         """Метод для фильтрации избранных рецептов"""
@@ -41,3 +47,15 @@ class RecipeFilter(FilterSet):
         if self.request.user.is_authenticated and value == 1:
             return queryset.filter(recipe_cart__user=self.request.user)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        """Метод для полнотекстового поиска рецептов"""
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        """Метод для сортировки рецептов. Рецепты в тренде
+           сортирует вью сет по индексу RecipeTrending
+        """
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-pub_date', '-id')
+        return queryset
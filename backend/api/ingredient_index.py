@@ -0,0 +1,48 @@
+from bisect import bisect_left
+
+from foodgram.versioning import get_version
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+       Отсортированный массив названий в нижнем регистре:
+       поиск по префиксу бинарный, затем совпадения по подстроке.
+    """
+
+    def __init__(self, ingredients):
+        self.ingredients = sorted(
+            ingredients, key=lambda item: (item['name'].casefold(),
+                                           item['id']))
+        self.names = [item['name'].casefold() for item in self.ingredients]
+
+    def search(self, query, limit=None):
+        """Метод поиска ингредиентов по началу и по части названия"""
+        query = query.casefold()
+        start = bisect_left(self.names, query)
+        end = bisect_left(self.names, query + '\U0010ffff', start)
+        result = self.ingredients[start:end][:limit]
+        if limit is not None and len(result) >= limit:
+            return result
+        for position, name in enumerate(self.names):
+            if start <= position < end or query not in name:
+                continue
+            result.append(self.ingredients[position])
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+
+_index = (None, None)
+
+
+def get_ingredient_index():
+    """Возвращает индекс, перестраивая его при смене версии справочника"""
+    global _index
+    version = get_version('ingredients')
+    index_version, index = _index
+    if index is None or version != index_version:
+        index = IngredientIndex(list(Ingredient.objects.values(
+            'id', 'name', 'measurement_unit')))
+        _index = (version, index)
+    return index
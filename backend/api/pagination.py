@@ -1,4 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
@@ -6,3 +15,181 @@ class CustomPagination(PageNumberPagination):
 
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """Пагинатор по ключу сортировки (курсору) без COUNT и OFFSET.
+       Позиция страницы — значения полей сортировки последней записи,
+       поэтому новые записи не сдвигают уже открытые страницы.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = queryset.order_by(*self.get_ordering(queryset))
+        return self.paginate_querysets((queryset,), request, view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """Страница объединения запросов. Сортировки запросов должны
+           быть уникальными и с одинаковыми значениями ключа, например
+           (pub_date, id) рецепта и (pub_date, recipe) строки ленты.
+           Каждый запрос читает не больше страницы по своему индексу,
+           страницы сливаются в памяти по значениям ключа
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        orderings = [list(queryset.query.order_by) for queryset in querysets]
+        self.ordering = orderings[0]
+        self.model = querysets[0].model
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor[0])
+        results = {}
+        for queryset, ordering in zip(querysets, orderings):
+            if cursor:
+                queryset = queryset.filter(
+                    self.get_position_filter(cursor[1], reverse, ordering))
+            if reverse:
+                queryset = queryset.order_by(
+                    *[self.invert(field) for field in ordering])
+            for obj in queryset[:self.page_size + 1]:
+                results.setdefault(tuple(
+                    self.get_value(obj, field) for field in ordering), obj)
+        keys = list(results)
+        if len(querysets) > 1:
+            for index in reversed(range(len(self.ordering))):
+                keys.sort(key=lambda key: key[index], reverse=(
+                    self.ordering[index].startswith('-') != reverse))
+        keys = keys[:self.page_size + 1]
+        has_more = len(keys) > self.page_size
+        keys = keys[:self.page_size]
+        if reverse:
+            keys.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.positions = keys
+        self.page = [results[key] for key in keys]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_ordering(self, queryset):
+        """Сортировка запроса, дополненная первичным ключом"""
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering)
+        if not all(isinstance(field, str) for field in ordering):
+            ordering = list(queryset.model._meta.ordering)
+        names = {field.lstrip('-') for field in ordering}
+        pk = queryset.model._meta.pk
+        if not names & {'pk', pk.name, pk.attname}:
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def get_position_filter(self, values, reverse, ordering=None):
+        """Условие «после позиции курсора» для составного ключа"""
+        ordering = ordering or self.ordering
+        position = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            after = field.startswith('-') == reverse
+            condition = Q(**{
+                f'{previous.lstrip("-")}': values[number]
+                for number, previous in enumerate(ordering[:index])})
+            condition &= Q(**{
+                f'{name}__{"gt" if after else "lt"}': values[index]})
+            position |= condition
+        return position
+
+    def get_value(self, obj, field):
+        """Значение поля сортировки; у связи — id без загрузки объекта"""
+        name = field.lstrip('-')
+        if name == 'pk':
+            return obj.pk
+        try:
+            name = obj._meta.get_field(name).attname
+        except FieldDoesNotExist:
+            pass
+        return getattr(obj, name)
+
+    def encode_cursor(self, values, reverse):
+        data = json.dumps(
+            [int(reverse), values],
+            default=lambda value: value.isoformat())
+        encoded = urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, values = json.loads(urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            values = [self.to_python(field, value)
+                      for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, values
+
+    def to_python(self, field, value):
+        name = field.lstrip('-')
+        try:
+            model_field = (self.model._meta.pk if name == 'pk'
+                           else self.model._meta.get_field(name))
+        except FieldDoesNotExist:
+            return value
+        return model_field.to_python(value)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.positions[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.positions[0], reverse=True)
+
+
+class KeysetPaginationMixin:
+    """Включение курсорной пагинации параметром cursor
+       или pagination=cursor, по умолчанию — постраничная
+    """
+
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if ('cursor' in params
+                    or params.get('pagination') == 'cursor'):
+                self._paginator = self.keyset_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -0,0 +1,271 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+from itertools import chain
+from threading import Lock, Thread
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from foodgram.versioning import get_version
+from recipes.models import IngredientRecipe, RecipeIngredientChange
+
+# Строки и записи журнала с id чуть меньше последнего прочитанного
+# перечитываются: транзакция с меньшим id могла закоммититься позже
+RESCAN_IDS = 1000
+
+
+class RankedRecipes:
+    """Результат поиска: id рецептов, доли имеющихся ингредиентов
+       и число недостающих. Кортежи создаются только для среза,
+       который попал на страницу
+    """
+
+    def __init__(self, ids, coverage, missing):
+        self.ids, self.coverage, self.missing = ids, coverage, missing
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return (int(self.ids[key]), float(self.coverage[key]),
+                    int(self.missing[key]))
+        return list(zip(self.ids[key].tolist(), self.coverage[key].tolist(),
+                        self.missing[key].tolist()))
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс ингредиент -> рецепты в памяти процесса.
+       Списки рецептов хранятся массивами numpy, число ингредиентов
+       рецепта — массивом с индексом по id рецепта. У рецептов,
+       у которых строки состава удалялись или менялись, записи
+       основных списков исключаются, а текущий состав хранится
+       в дополнительных списках до следующей перестройки
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.sizes = np.zeros(0, dtype=np.uint16)
+        self.excluded = np.zeros(0, dtype=np.int64)
+        self.extra = {}
+        self.last_id = 0
+        self.seen_ids = frozenset()
+        self.last_change_id = 0
+        self.seen_change_ids = frozenset()
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        """Индекс по всей таблице состава рецептов"""
+        index = cls()
+        # Журнал читается до таблицы: изменения во время загрузки
+        # будут применены при следующем обновлении
+        index.last_change_id = RecipeIngredientChange.objects.aggregate(
+            last=Max('id'))['last'] or 0
+        index.seen_change_ids = frozenset(
+            RecipeIngredientChange.objects.filter(
+                id__gt=index.last_change_id - RESCAN_IDS,
+            ).values_list('id', flat=True))
+        rows = np.fromiter(chain.from_iterable(
+            IngredientRecipe.objects.values_list(
+                'id', 'recipe_id', 'ingredient_id').iterator()),
+            dtype=np.int64).reshape(-1, 3)
+        if len(rows):
+            row_ids = rows[:, 0]
+            index.last_id = int(row_ids.max())
+            index.seen_ids = frozenset(
+                row_ids[row_ids > index.last_id - RESCAN_IDS].tolist())
+            recipes, ingredients = rows[:, 1], rows[:, 2]
+            order = np.lexsort((recipes, ingredients))
+            recipes = recipes[order].astype(np.uint32)
+            ingredients = ingredients[order]
+            keys, starts = np.unique(ingredients, return_index=True)
+            bounds = starts.tolist() + [len(ingredients)]
+            index.postings = {
+                ingredient_id: recipes[bounds[number]:bounds[number + 1]]
+                for number, ingredient_id in enumerate(keys.tolist())}
+            index.sizes = np.bincount(rows[:, 1]).astype(np.uint16)
+        return index
+
+    def updated(self, rows, changed):
+        """Копия индекса с новыми строками rows (id, recipe_id,
+           ingredient_id) и текущим составом changed {recipe_id:
+           [ingredient_id]} изменившихся рецептов. Копируются только
+           затронутые массивы, текущий индекс остаётся доступным
+        """
+        index = RecipeIngredientIndex()
+        index.postings = dict(self.postings)
+        index.extra = dict(self.extra)
+        index.built_at = self.built_at
+        top = max([len(self.sizes) - 1]
+                  + [recipe_id for _, recipe_id, _ in rows] + list(changed))
+        index.sizes = np.zeros(top + 1, dtype=np.uint16)
+        index.sizes[:len(self.sizes)] = self.sizes
+        excluded = set(self.excluded.tolist())
+        if changed:
+            drop = np.fromiter(changed, dtype=np.int64)
+            for ingredient_id, posting in self.extra.items():
+                index.extra[ingredient_id] = posting[
+                    np.isin(posting, drop, invert=True)]
+            excluded.update(changed)
+            index.sizes[drop] = [len(changed[recipe_id])
+                                 for recipe_id in drop.tolist()]
+        base, extra = defaultdict(list), defaultdict(list)
+        for _, recipe_id, ingredient_id in rows:
+            if recipe_id in changed:
+                continue
+            target = extra if recipe_id in excluded else base
+            target[ingredient_id].append(recipe_id)
+            index.sizes[recipe_id] += 1
+        for recipe_id, ingredient_ids in changed.items():
+            for ingredient_id in ingredient_ids:
+                extra[ingredient_id].append(recipe_id)
+        for postings, added in ((index.postings, base),
+                                (index.extra, extra)):
+            for ingredient_id, recipe_ids in added.items():
+                postings[ingredient_id] = np.concatenate((
+                    postings.get(ingredient_id, np.zeros(0, np.uint32)),
+                    np.array(recipe_ids, dtype=np.uint32)))
+        index.excluded = np.array(sorted(excluded), dtype=np.int64)
+        return index
+
+    def search(self, ingredient_ids, threshold=0.0):
+        """Рецепты, отсортированные по доле имеющихся ингредиентов
+           и числу недостающих: последовательность (id, доля, недостаёт)
+        """
+        ingredient_ids = set(ingredient_ids)
+        size = len(self.sizes)
+        counts = count(self.postings, ingredient_ids, size)
+        if len(self.excluded):
+            counts[self.excluded] = 0
+        counts += count(self.extra, ingredient_ids, size)
+        found = np.flatnonzero(counts)
+        covered = counts[found]
+        sizes = np.maximum(self.sizes[found].astype(np.int64), covered)
+        coverage = covered / sizes
+        keep = coverage >= threshold
+        found, covered = found[keep], covered[keep]
+        sizes, coverage = sizes[keep], coverage[keep]
+        missing = sizes - covered
+        order = np.lexsort((-found, missing, -coverage))
+        return RankedRecipes(found[order], coverage[order], missing[order])
+
+    def age(self):
+        return time.monotonic() - self.built_at
+
+    def needs_rebuild(self):
+        """Исключённых рецептов стало много или журнал изменений
+           скоро будет очищен
+        """
+        return (len(self.excluded) > max(
+            settings.RECIPE_INDEX_MAX_EXCLUDED, len(self.sizes) // 100)
+            or self.age() > settings.RECIPE_INDEX_CHANGES_RETENTION / 2)
+
+
+def count(postings, ingredient_ids, size):
+    """Число совпавших ингредиентов по каждому рецепту"""
+    parts = [postings[ingredient_id] for ingredient_id in ingredient_ids
+             if ingredient_id in postings]
+    if not parts:
+        return np.zeros(size, dtype=np.int64)
+    return np.bincount(np.concatenate(parts), minlength=size)[:size]
+
+
+def read_after(queryset, last_id, seen_ids):
+    """Записи с id больше last_id и ещё не прочитанные записи
+       из окна RESCAN_IDS перед ним
+    """
+    rows = [row for row in queryset.filter(
+        id__gt=last_id - RESCAN_IDS).order_by('id')
+        if row[0] not in seen_ids]
+    if rows:
+        last_id = max(last_id, rows[-1][0])
+    seen_ids = frozenset(
+        [row_id for row_id in seen_ids if row_id > last_id - RESCAN_IDS]
+        + [row[0] for row in rows if row[0] > last_id - RESCAN_IDS])
+    return rows, last_id, seen_ids
+
+
+def refresh(index):
+    """Индекс с новыми строками состава и изменёнными рецептами"""
+    changes, last_change_id, seen_change_ids = read_after(
+        RecipeIngredientChange.objects.values_list('id', 'recipe_id'),
+        index.last_change_id, index.seen_change_ids)
+    rows, last_id, seen_ids = read_after(
+        IngredientRecipe.objects.values_list(
+            'id', 'recipe_id', 'ingredient_id'),
+        index.last_id, index.seen_ids)
+    if not changes and not rows:
+        return index
+    changed = {recipe_id: [] for _, recipe_id in changes}
+    reloaded = []
+    for row_id, recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+            recipe_id__in=changed).values_list(
+            'id', 'recipe_id', 'ingredient_id'):
+        changed[recipe_id].append(ingredient_id)
+        reloaded.append(row_id)
+    # Строки, закоммиченные между чтениями, уже учтены в составе
+    # перечитанных рецептов и не должны добавиться ещё раз
+    seen_ids |= {row_id for row_id in reloaded
+                 if row_id > last_id - RESCAN_IDS}
+    index = index.updated(rows, changed)
+    index.last_id, index.seen_ids = last_id, seen_ids
+    index.last_change_id = last_change_id
+    index.seen_change_ids = seen_change_ids
+    return index
+
+
+_index = (None, None)
+_lock = Lock()
+_rebuilding = Lock()
+
+
+def rebuild():
+    """Перестройка индекса в фоновом потоке: запросы тем временем
+       обслуживает текущий индекс
+    """
+    global _index
+    try:
+        RecipeIngredientChange.objects.filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=settings.RECIPE_INDEX_CHANGES_RETENTION),
+        ).delete()
+        index = RecipeIngredientIndex.build()
+        with _lock:
+            version = get_version('recipe_ingredients')
+            _index = (version, refresh(index))
+    finally:
+        connection.close()
+        _rebuilding.release()
+
+
+def get_recipe_ingredient_index():
+    """Возвращает индекс, обновляя его при смене версии данных:
+       новые строки добавляются, удалённые и изменённые рецепты
+       перечитываются. Полная перестройка идёт в фоне; синхронно
+       индекс строится только при первом запросе и если он старше
+       журнала изменений
+    """
+    global _index
+    version = get_version('recipe_ingredients')
+    index_version, index = _index
+    if index is not None and (
+            index.age() > settings.RECIPE_INDEX_CHANGES_RETENTION):
+        index = None
+    if index is None or version != index_version:
+        with _lock:
+            index_version, index = _index
+            if index is None or (
+                    index.age() > settings.RECIPE_INDEX_CHANGES_RETENTION):
+                index = RecipeIngredientIndex.build()
+                index = refresh(index)
+            elif version != index_version:
+                index = refresh(index)
+            _index = (version, index)
+    if index.needs_rebuild() and _rebuilding.acquire(blocking=False):
+        Thread(target=rebuild, daemon=True).start()
+    return index
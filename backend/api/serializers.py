@@ -1,17 +1,52 @@
 import base64
+from collections import defaultdict
 
 from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Manager, Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            Subscription, Tag, TagRecipe)
-from shopping_cart.models import ShoppingCart
+from foodgram.constants import BULK_RECIPES_LIMIT
+from foodgram.metrics import measure_serialization
+from foodgram.versioning import bump_version
+from recipes.images import get_variant_urls, schedule_variants
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            RecipeIngredientChange, Subscription, Tag,
+                            TagRecipe)
+from recipes.signals import batched_changes
+from shopping_cart.shopping_list import change_recipe
 from users.models import User
+from .viewer import get_viewer
 
 
-class UserReadSerializer(serializers.ModelSerializer):
+class TimedDataMixin:
+    """Время получения serializer.data попадает в метрики запроса"""
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class ViewerListSerializer(TimedListSerializer):
+    """Сериалайзер списка, загружающий связи пользователя
+       для всей страницы одним набором запросов
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get('request')
+        if request is not None:
+            self.child.prime_viewer(get_viewer(request), items)
+        return super().to_representation(items)
+
+
+class UserReadSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для получения пользователя"""
 
     username = serializers.CharField(
@@ -22,29 +57,35 @@ class UserReadSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed')
+        list_serializer_class = ViewerListSerializer
+
+    def prime_viewer(self, viewer, users):
+        viewer.prime(author_ids=[user.id for user in users])
 
     def get_is_subscribed(self, obj):
         """Метод определения подписки на автора"""
-        request = self.context.get('request')
-        return (not request.user.is_anonymous and request.user != obj and
-                Subscription.objects.filter(
-                    user=request.user, author=obj).exists())
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+        return get_viewer(self.context['request']).is_subscribed(obj.id)
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для тегов"""
 
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
+        list_serializer_class = TimedListSerializer
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для ингредиентов"""
 
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
+        list_serializer_class = TimedListSerializer
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -71,7 +112,7 @@ class Base64ImageField(serializers.ImageField):
         return super().to_internal_value(data)
 
 
-class RecipeAddSerializer(serializers.ModelSerializer):
+class RecipeAddSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для добавления рецептов"""
 
     tags = serializers.ListField()
@@ -86,63 +127,151 @@ class RecipeAddSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         """Метод проверки данных"""
-        if data['cooking_time'] <= 0:
+        cooking_time = data.get('cooking_time')
+        if cooking_time is not None and cooking_time <= 0:
             raise serializers.ValidationError(
                 'Время приготовления должно быть больше 0.'
             )
-        ingredients = []
-        for ingredient in data.get('ingredients'):
-            if int(ingredient.get('amount')) <= 0:
+        return data
+
+    def validate_tags(self, value):
+        """Метод проверки тегов одним запросом"""
+        try:
+            tag_ids = [int(tag) for tag in value]
+        except (TypeError, ValueError):
+            raise serializers.ValidationError('Некорректный тег.')
+        if len(set(tag_ids)) != len(tag_ids):
+            raise serializers.ValidationError('Теги не должны повторяться.')
+        tags = Tag.objects.in_bulk(tag_ids)
+        if len(tags) != len(tag_ids):
+            raise serializers.ValidationError('Тег не найден.')
+        return [tags[tag_id] for tag_id in tag_ids]
+
+    def validate_ingredients(self, value):
+        """Метод проверки ингредиентов одним запросом"""
+        amounts = {}
+        for ingredient in value:
+            try:
+                id_ingredient = int(ingredient['id'])
+                amount = int(ingredient['amount'])
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError(
+                    'Некорректный ингредиент.')
+            if amount <= 0:
                 raise serializers.ValidationError(
                     'Количество ингредиента должно быть больше 0.')
-            id_ingredient = ingredient.get('id')
-            if id_ingredient in ingredients:
+            if id_ingredient in amounts:
                 raise serializers.ValidationError(
                     'Ингредиент не должен повторяться.')
-            ingredients.append(id_ingredient)
-        return data
-
-    def create_tags_ingredients_objects(self, tags, ingredients, recipe):
-        """Метод для создания Тегов и Ингредиентов для Рецептов"""
-        TagRecipe.objects.bulk_create([
-            TagRecipe(tag=get_object_or_404(Tag, id=tag),
-                      recipe=recipe) for tag in tags])
-        IngredientRecipe.objects.bulk_create([
-            IngredientRecipe(ingredient=get_object_or_404(
-                Ingredient, id=ingredient.get('id')), recipe=recipe,
-                amount=ingredient.get('amount')) for ingredient in ingredients])
-
+            amounts[id_ingredient] = amount
+        ingredients = Ingredient.objects.in_bulk(list(amounts))
+        if len(ingredients) != len(amounts):
+            raise serializers.ValidationError('Ингредиент не найден.')
+        return [{'ingredient': ingredients[id_ingredient], 'amount': amount}
+                for id_ingredient, amount in amounts.items()]
+
+    def set_tags(self, recipe, tags, created=False):
+        """Метод изменения тегов рецепта только на разницу"""
+        new = {tag.id for tag in tags}
+        current = set() if created else set(TagRecipe.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        if current - new:
+            TagRecipe.objects.filter(
+                recipe=recipe, tag_id__in=current - new).delete()
+        if new - current:
+            TagRecipe.objects.bulk_create([
+                TagRecipe(recipe=recipe, tag_id=tag_id)
+                for tag_id in new - current])
+
+    def set_ingredients(self, recipe, ingredients, created=False):
+        """Метод изменения ингредиентов рецепта только на разницу"""
+        new = {ingredient['ingredient'].id: ingredient['amount']
+               for ingredient in ingredients}
+        current = {} if created else {
+            ingredient_recipe.ingredient_id: ingredient_recipe
+            for ingredient_recipe in IngredientRecipe.objects.filter(
+                recipe=recipe)}
+        removed = current.keys() - new.keys()
+        # Разница количеств для списков покупок с этим рецептом
+        changes = {
+            id_ingredient: new.get(id_ingredient, 0) - (
+                current[id_ingredient].amount
+                if id_ingredient in current else 0)
+            for id_ingredient in current.keys() | new.keys()}
+        if removed:
+            # Списки покупок и журнал состава меняются одним пакетом,
+            # а не приёмниками сигналов по каждой строке
+            with batched_changes():
+                IngredientRecipe.objects.filter(
+                    recipe=recipe, ingredient_id__in=removed).delete()
+            RecipeIngredientChange.objects.create(recipe_id=recipe.id)
+        changed = []
+        for id_ingredient, amount in new.items():
+            ingredient_recipe = current.get(id_ingredient)
+            if ingredient_recipe is not None and (
+                    ingredient_recipe.amount != amount):
+                ingredient_recipe.amount = amount
+                changed.append(ingredient_recipe)
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        if new.keys() - current.keys():
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe=recipe, ingredient_id=id_ingredient,
+                    amount=new[id_ingredient])
+                for id_ingredient in new.keys() - current.keys()])
+        if removed or new.keys() - current.keys():
+            transaction.on_commit(
+                lambda: bump_version('recipe_ingredients'))
+        if not created:
+            change_recipe(recipe.id, changes)
+
+    @transaction.atomic
     def create(self, validated_data):
         """Метод создания рецепта"""
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        self.create_tags_ingredients_objects(tags, ingredients, recipe)
+        self.set_tags(recipe, tags, created=True)
+        self.set_ingredients(recipe, ingredients, created=True)
+        transaction.on_commit(lambda: bump_version('recipes'))
+        schedule_variants(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Метод обновления рецепта"""
-        tags = validated_data.pop('tags', instance.tags)
-        ingredients = validated_data.pop('ingredients', instance.ingredients)
+        if 'tags' in validated_data:
+            self.set_tags(instance, validated_data.pop('tags'))
+        if 'ingredients' in validated_data:
+            self.set_ingredients(instance, validated_data.pop('ingredients'))
         instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
+        if 'image' in validated_data:
+            instance.image = validated_data['image']
+            instance.image_variants_ready = False
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
-        TagRecipe.objects.filter(recipe=instance).delete()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        self.create_tags_ingredients_objects(tags, ingredients, instance)
         instance.save()
+        transaction.on_commit(lambda: bump_version('recipes'))
+        if not instance.image_variants_ready:
+            schedule_variants(instance.id)
         return instance
 
     def to_representation(self, instance):
         """Метод переопределяющий вывод информации"""
         request = self.context.get('request')
+        instance._prefetched_objects_cache = {}
+        prefetch_related_objects(
+            [instance], 'tags', Prefetch(
+                'recipe_from_ingredient',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient')))
         serializer = RecipeSerializer(instance, context={'request': request})
         return serializer.data
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для рецептов"""
 
     author = UserReadSerializer()
@@ -150,43 +279,107 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = IngredientRecipeSerializer(
         source='recipe_from_ingredient', many=True)
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time')
         read_only_fields = ('tags', 'author', 'ingredients')
+        list_serializer_class = ViewerListSerializer
+
+    def prime_viewer(self, viewer, recipes):
+        viewer.prime(author_ids=[recipe.author_id for recipe in recipes],
+                     recipe_ids=[recipe.id for recipe in recipes])
+
+    def to_representation(self, instance):
+        """Передача аннотированного флага подписки вложенному автору"""
+        author_is_subscribed = getattr(
+            instance, 'author_is_subscribed', None)
+        if author_is_subscribed is not None:
+            instance.author.is_subscribed = (
+                author_is_subscribed
+                and instance.author_id != self.context['request'].user.id)
+        return super().to_representation(instance)
+
+    def get_image_variants(self, obj):
+        """Метод получения ссылок на уменьшенные копии изображения"""
+        return get_variant_urls(obj, self.context.get('request'))
 
     def get_is_favorited(self, obj):
         """Метод определения рецепта в избранном"""
-        request = self.context.get('request')
-        return (not request.user.is_anonymous and
-                Favorite.objects.filter(
-                    user=request.user, recipe=obj).exists())
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
+        return get_viewer(self.context['request']).is_favorited(obj.id)
 
     def get_is_in_shopping_cart(self, obj):
         """Метод определения рецепта в избранном"""
-        request = self.context.get('request')
-        return (not request.user.is_anonymous and
-                ShoppingCart.objects.filter(
-                    user=request.user, recipe=obj).exists())
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
+        return get_viewer(
+            self.context['request']).is_in_shopping_cart(obj.id)
 
 
-class RecipeSmallSerializer(serializers.ModelSerializer):
+class RecipeSmallSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для короткого вывода рецептов"""
 
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
+    def get_image_variants(self, obj):
+        """Метод получения ссылок на уменьшенные копии изображения"""
+        return get_variant_urls(obj, self.context.get('request'))
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    """Сериалайзер для проверки параметра recipes_limit"""
+
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Сериалайзер для списка id рецептов в пакетных операциях"""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT)
+
+
+class ByIngredientsSerializer(serializers.Serializer):
+    """Сериалайзер для параметров поиска рецептов по ингредиентам"""
 
-class SubscriptionsSerializer(serializers.ModelSerializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False)
+    threshold = serializers.FloatField(
+        min_value=0, max_value=1, required=False, default=0)
+
+
+class SubscriptionsListSerializer(ViewerListSerializer):
+    """Сериалайзер списка подписок, загружающий рецепты всех авторов
+       страницы одним запросом
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        self.recipes_by_author = defaultdict(list)
+        for recipe in Recipe.objects.latest_for_authors(
+                [subscription.author_id for subscription in items],
+                self.context.get('recipes_limit')):
+            self.recipes_by_author[recipe.author_id].append(recipe)
+        return super().to_representation(items)
+
+
+class SubscriptionsSerializer(TimedDataMixin, serializers.ModelSerializer):
     """Сериалайзер для отображения всех подписок"""
 
     email = serializers.ReadOnlyField(source='author.email')
@@ -196,34 +389,32 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
 
     class Meta:
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
         model = Subscription
+        list_serializer_class = SubscriptionsListSerializer
+
+    def prime_viewer(self, viewer, subscriptions):
+        viewer.prime(author_ids=[
+            subscription.author_id for subscription in subscriptions])
 
     def get_is_subscribed(self, obj):
         """Метод определения подписки на автора"""
-        request = self.context.get('request')
-        return (not request.user == obj.author and
-                Subscription.objects.filter(
-                    user=request.user, author=obj.author).exists())
+        return get_viewer(
+            self.context['request']).is_subscribed(obj.author_id)
 
     def get_recipes(self, obj):
         """Метод получения рецептов автора"""
-        request = self.context.get('request')
-        if request.GET.get('recipes_limit'):
-            recipe_limit = int(request.GET.get('recipes_limit'))
-            queryset = Recipe.objects.filter(
-                author=obj.author).all()[:recipe_limit]
+        recipes_by_author = getattr(self.parent, 'recipes_by_author', None)
+        if recipes_by_author is not None:
+            queryset = recipes_by_author[obj.author_id]
         else:
-            queryset = Recipe.objects.filter(author=obj.author).all()
+            queryset = Recipe.objects.filter(author=obj.author_id)[
+                :self.context.get('recipes_limit')]
         serializer = RecipeSmallSerializer(
             queryset, read_only=True, many=True
         )
         return serializer.data
-
-    def get_recipes_count(self, obj):
-        """Метод получения рецептов автора"""
-        return obj.author.recipes.count()
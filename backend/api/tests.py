@@ -0,0 +1,270 @@
+import threading
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from foodgram.constants import AUTH_TOKEN_VERSION
+from foodgram.versioning import peek_version
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            Subscription, Tag, TagRecipe)
+from shopping_cart.models import ShoppingCart, ShoppingListItem
+from users.models import User
+
+PAGE_SIZES = (6, 50, 200)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryCountTest(APITestCase):
+    """Число запросов к базе на страницу списка не зависит
+       от размера страницы
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@foodgram.ru', username='reader',
+            first_name='Читатель', last_name='Тестовый', password='pass')
+        authors = [
+            User.objects.create_user(
+                email=f'author{number}@foodgram.ru',
+                username=f'author{number}', first_name='Автор',
+                last_name='Тестовый', password='pass')
+            for number in range(max(PAGE_SIZES))]
+        tags = [Tag.objects.create(name=f'Тег {number}', color='#FFFFFF',
+                                   slug=f'tag{number}')
+                for number in range(2)]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)]
+        for number, author in enumerate(authors):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            for tag in tags:
+                TagRecipe.objects.create(recipe=recipe, tag=tag)
+            for ingredient in ingredients:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=100)
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def assert_constant_queries(self, url, results_key='results'):
+        expected, data = self.count_queries(f'{url}limit={PAGE_SIZES[0]}')
+        self.assertEqual(len(data[results_key]), PAGE_SIZES[0])
+        for page_size in PAGE_SIZES[1:]:
+            with self.assertNumQueries(expected):
+                response = self.client.get(f'{url}limit={page_size}')
+            self.assertEqual(len(response.json()[results_key]), page_size)
+
+    def test_recipes_list(self):
+        self.assert_constant_queries('/api/recipes/?')
+
+    def test_recipes_list_cursor(self):
+        self.assert_constant_queries('/api/recipes/?pagination=cursor&')
+
+    def test_subscriptions_list(self):
+        self.assert_constant_queries(
+            '/api/users/subscriptions/?recipes_limit=3&')
+
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RecipesLimitTest(APITestCase):
+    """recipes_limit ограничивает рецепты каждого автора подписки,
+       оставляя самые новые
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@foodgram.ru', username='reader',
+            first_name='Читатель', last_name='Тестовый', password='pass')
+        cls.recipes = {}
+        for number, count in enumerate((4, 1, 0)):
+            author = User.objects.create_user(
+                email=f'author{number}@foodgram.ru',
+                username=f'author{number}', first_name='Автор',
+                last_name='Тестовый', password='pass')
+            Subscription.objects.create(user=cls.user, author=author)
+            cls.recipes[author.id] = [
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {index}',
+                    image='recipes/images/test.png', text='Описание',
+                    cooking_time=10).id
+                for index in range(count)]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_limit_per_author(self):
+        for limit in (1, 2, 5):
+            response = self.client.get(
+                f'/api/users/subscriptions/?recipes_limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            for author in response.json()['results']:
+                expected = self.recipes[author['id']][::-1][:limit]
+                self.assertEqual(
+                    [recipe['id'] for recipe in author['recipes']], expected)
+                self.assertEqual(
+                    author['recipes_count'], len(self.recipes[author['id']]))
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConcurrentToggleTest(TransactionTestCase):
+    """Одновременные одинаковые клики добавляют одну строку
+       и меняют счётчики один раз
+    """
+
+    clicks = 4
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не допускает параллельной '
+                          'записи, задайте DB_TEST_NAME')
+        self.user = User.objects.create_user(
+            email='reader@foodgram.ru', username='reader',
+            first_name='Читатель', last_name='Тестовый', password='pass')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', image='recipes/images/test.png',
+            text='Описание', cooking_time=10)
+        self.ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г')
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=100)
+
+    def click(self, method, url):
+        """Одновременные запросы из разных потоков, коды ответов"""
+        barrier = threading.Barrier(self.clicks)
+        statuses = []
+
+        def send():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                statuses.append(getattr(client, method)(url).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send) for _ in range(self.clicks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def test_add_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.assertEqual(self.click('post', url),
+                         [201] + [400] * (self.clicks - 1))
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.cart_count, 1)
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).amount, 100)
+
+    def test_add_favorite(self):
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.assertEqual(self.click('post', url),
+                         [201] + [400] * (self.clicks - 1))
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_remove(self):
+        if connection.vendor == 'sqlite':
+            # Удаление сначала читает строки, и SQLite отказывает
+            # параллельной транзакции в блокировке на запись
+            self.skipTest('SQLite не выполняет параллельные удаления')
+        for prefix in ('shopping_cart', 'favorite'):
+            url = f'/api/recipes/{self.recipe.id}/{prefix}/'
+            self.click('post', url)
+            self.assertEqual(self.click('delete', url),
+                             [204] + [404] * (self.clicks - 1))
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(ShoppingListItem.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.cart_count, self.recipe.favorites_count), (0, 0))
+
+    def test_repeat_and_missing_recipe(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.assertEqual(client.post(url).status_code, 201)
+        self.assertEqual(client.post(url).status_code, 400)
+        self.assertEqual(client.delete(url).status_code, 204)
+        self.assertEqual(client.delete(url).status_code, 404)
+        url = f'/api/recipes/{self.recipe.id + 1}/favorite/'
+        self.assertEqual(client.post(url).status_code, 404)
+        self.assertFalse(Favorite.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TokenCacheTest(APITestCase):
+    """Кеш аутентификации сбрасывает только токены пользователя,
+       у которого сменились пароль или активность
+    """
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'user{number}@foodgram.ru', username=f'user{number}',
+                first_name='Пользователь', last_name='Тестовый',
+                password='pass')
+            for number in range(2)]
+        self.tokens = [Token.objects.create(user=user) for user in self.users]
+
+    def get_me(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return self.client.get('/api/users/me/').status_code
+
+    def get_versions(self):
+        return [peek_version(AUTH_TOKEN_VERSION.format(token.key))
+                for token in self.tokens]
+
+    def test_profile_change_keeps_tokens(self):
+        self.users[0].first_name = 'Другое'
+        self.users[0].save()
+        self.users[0].save(update_fields=('last_login',))
+        self.assertEqual(self.get_versions(), [None, None])
+
+    def test_deactivation_evicts_own_token(self):
+        self.assertEqual(self.get_me(self.tokens[0]), 200)
+        self.users[0].is_active = False
+        self.users[0].save()
+        self.assertEqual(self.get_me(self.tokens[0]), 401)
+        self.assertEqual(self.get_me(self.tokens[1]), 200)
+        self.assertIsNone(self.get_versions()[1])
+
+    def test_password_change_and_delete_evict_token(self):
+        self.users[0].set_password('new pass')
+        self.users[0].save()
+        first = self.get_versions()[0]
+        self.assertIsNotNone(first)
+        self.users[0].delete()
+        self.assertNotEqual(self.get_versions()[0], first)
+        self.assertEqual(self.get_me(self.tokens[0]), 401)
@@ -1,9 +1,10 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import (FavoriteAPIView, IngredientViewSet, RecipeViewSet,
-                    ShoppingCartAPIView, SubscribeAPIView,
-                    SubscriptionsListAPIView, TagViewSet)
+from .views import (FavoriteAPIView, FavoriteBulkAPIView, IngredientViewSet,
+                    MetricsAPIView, ReadinessAPIView, RecipeViewSet,
+                    ShoppingCartAPIView, ShoppingCartBulkAPIView,
+                    SubscribeAPIView, SubscriptionsListAPIView, TagViewSet)
 
 app_name = 'api'
 
@@ -23,5 +24,11 @@ urlpatterns = [
          name='favorite'),
     path('recipes/<int:recipe_id>/shopping_cart/', ShoppingCartAPIView.as_view(),
          name='shopping_cart'),
+    path('recipes/favorite/', FavoriteBulkAPIView.as_view(),
+         name='favorite_bulk'),
+    path('recipes/shopping_cart/', ShoppingCartBulkAPIView.as_view(),
+         name='shopping_cart_bulk'),
+    path('_ready', ReadinessAPIView.as_view(), name='ready'),
+    path('_metrics', MetricsAPIView.as_view(), name='metrics'),
     path('', include(router_v1.urls)),
 ]
@@ -0,0 +1,70 @@
+from recipes.models import Favorite, Subscription
+from shopping_cart.models import ShoppingCart
+
+
+class _Relation:
+    """Множество id, связанных с текущим пользователем.
+       Загружается одним запросом для всех id страницы.
+    """
+
+    def __init__(self, queryset, field):
+        self.queryset = queryset
+        self.field = field
+        self.checked = set()
+        self.pending = set()
+        self.found = set()
+
+    def prime(self, ids):
+        self.pending.update(set(ids) - self.checked)
+
+    def __contains__(self, pk):
+        if pk not in self.checked:
+            self.pending.add(pk)
+            self.found.update(self.queryset.filter(**{
+                f'{self.field}__in': self.pending}).values_list(
+                    self.field, flat=True))
+            self.checked.update(self.pending)
+            self.pending = set()
+        return pk in self.found
+
+
+class ViewerContext:
+    """Связи текущего пользователя с авторами и рецептами в рамках запроса"""
+
+    def __init__(self, user):
+        self.user = user
+        if user.is_anonymous:
+            return
+        self.followed = _Relation(
+            Subscription.objects.filter(user=user), 'author_id')
+        self.favorited = _Relation(
+            Favorite.objects.filter(user=user), 'recipe_id')
+        self.in_cart = _Relation(
+            ShoppingCart.objects.filter(user=user), 'recipe_id')
+
+    def prime(self, author_ids=(), recipe_ids=()):
+        """Метод добавления id страницы в общий запрос"""
+        if self.user.is_anonymous:
+            return
+        self.followed.prime(author_ids)
+        self.favorited.prime(recipe_ids)
+        self.in_cart.prime(recipe_ids)
+
+    def is_subscribed(self, author_id):
+        return (not self.user.is_anonymous and self.user.id != author_id
+                and author_id in self.followed)
+
+    def is_favorited(self, recipe_id):
+        return not self.user.is_anonymous and recipe_id in self.favorited
+
+    def is_in_shopping_cart(self, recipe_id):
+        return not self.user.is_anonymous and recipe_id in self.in_cart
+
+
+def get_viewer(request):
+    """Возвращает контекст пользователя, общий для всего запроса"""
+    viewer = getattr(request, '_viewer_context', None)
+    if viewer is None or viewer.user != request.user:
+        viewer = ViewerContext(request.user)
+        request._viewer_context = viewer
+    return viewer
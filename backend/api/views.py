@@ -1,26 +1,53 @@
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import ListAPIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from api.pagination import CustomPagination
-from recipes.models import Favorite, Ingredient, Recipe, Subscription, Tag
+from api.cache import AnonymousResponseCacheMixin, PrecomputedListMixin
+from api.pagination import (CustomPagination, KeysetPagination,
+                            KeysetPaginationMixin)
+from foodgram.metrics import collect, render_prometheus
+from foodgram.versioning import get_version
+from recipes.bulk import (delete_returning, insert_ignore_conflicts,
+                          is_foreign_key_violation)
+from recipes.counters import change_counter
+from recipes.models import (Favorite, FeedInbox, Ingredient, IngredientRecipe,
+                            Recipe, RecipeTrending, Subscription, Tag)
 from shopping_cart.download_cart import download_ingredients
 from shopping_cart.models import ShoppingCart
+from shopping_cart.shopping_list import change_carts
 from users.models import User
 from .filters import IngredientFilter, RecipeFilter
+from .ingredient_index import get_ingredient_index
 from .permissions import OwnerOrReadPermission
-from .serializers import (IngredientSerializer, RecipeAddSerializer,
+from .recipe_ingredient_index import get_recipe_ingredient_index
+from .serializers import (ByIngredientsSerializer, IngredientSerializer,
+                          RecipeAddSerializer, RecipeIdsSerializer,
                           RecipeSerializer, RecipeSmallSerializer,
-                          SubscriptionsSerializer, TagSerializer,)
+                          RecipesLimitSerializer, SubscriptionsSerializer,
+                          TagSerializer,)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def get_recipes_limit(request):
+    """Проверенное значение параметра recipes_limit"""
+    serializer = RecipesLimitSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data.get('recipes_limit')
+
+
+class RecipeViewSet(AnonymousResponseCacheMixin, KeysetPaginationMixin,
+                    viewsets.ModelViewSet):
     """Вью сет для рецептов"""
 
     queryset = Recipe.objects.all()
@@ -28,6 +55,55 @@ class RecipeViewSet(viewsets.ModelViewSet):
     pagination_class = CustomPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    cache_versions = ('recipes', 'ingredients', 'tags')
+    cache_query_params = ('author', 'cursor', 'limit', 'page', 'pagination',
+                          'tags')
+
+    def get_queryset(self):
+        """Рецепты со всеми связями, загружаемые фиксированным
+           числом запросов независимо от размера страницы
+        """
+        user = self.request.user
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'recipe_from_ingredient',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient')),
+        )
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+                author_is_subscribed=Value(
+                    False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    def paginate_queryset(self, queryset):
+        """Рецепты в тренде листаются по индексу (score, recipe)
+           таблицы RecipeTrending, без соединения с рецептами.
+           Рецепты страницы загружаются одним запросом по id
+        """
+        params = self.request.query_params
+        if params.get('ordering') != 'trending' or self.paginator is None:
+            return super().paginate_queryset(queryset)
+        trending = RecipeTrending.objects.only('recipe', 'score')
+        if queryset.query.where:
+            trending = trending.filter(recipe__in=queryset.values('pk'))
+        page = super().paginate_queryset(
+            trending.order_by('-score', '-recipe_id'))
+        recipe_ids = [item.recipe_id for item in page]
+        recipes = queryset.in_bulk(recipe_ids)
+        return [recipes[recipe_id] for recipe_id in recipe_ids
+                if recipe_id in recipes]
 
     def get_serializer_class(self):
         """Определение сериалайзера для пользователей"""
@@ -50,16 +126,74 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK,
         )
 
-
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=False, methods=('get',), url_path='by-ingredients',
+            url_name='by_ingredients')
+    def by_ingredients(self, request, *args, **kwargs):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов:
+           сначала с наибольшей долей имеющихся, затем с наименьшим
+           числом недостающих
+        """
+        params = ByIngredientsSerializer(data={
+            'ingredients': [
+                value for values in request.query_params.getlist(
+                    'ingredients') for value in values.split(',') if value],
+            'threshold': request.query_params.get('threshold', 0),
+        })
+        params.is_valid(raise_exception=True)
+        ranked = get_recipe_ingredient_index().search(
+            params.validated_data['ingredients'],
+            params.validated_data['threshold'])
+        paginator = CustomPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        page = [item for item in page if item[0] in recipes]
+        serializer = RecipeSerializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True,
+            context=self.get_serializer_context())
+        for data, (_, coverage, missing) in zip(serializer.data, page):
+            data['coverage'] = round(coverage, 4)
+            data['missing'] = missing
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=('get',), url_name='feed',
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request, *args, **kwargs):
+        """Лента рецептов авторов из подписок, новые сверху.
+           Ключи страницы (pub_date, id) рецептов обычных авторов
+           читаются по индексу (author, pub_date), рецептов авторов
+           с рассылкой — по индексу ленты подписчика FeedInbox.
+           Рецепты страницы загружаются одним запросом по id
+        """
+        user = request.user
+        paginator = KeysetPagination()
+        paginator.paginate_querysets((
+            Recipe.objects.filter(author__in=Subscription.objects.filter(
+                user=user, author__feed_fanout=False).values('author'),
+            ).only('id', 'pub_date').order_by('-pub_date', '-id'),
+            FeedInbox.objects.filter(user=user).only(
+                'recipe', 'pub_date').order_by('-pub_date', '-recipe_id'),
+        ), request, view=self)
+        recipe_ids = [recipe_id for _, recipe_id in paginator.positions]
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = RecipeSerializer(
+            [recipes[recipe_id] for recipe_id in recipe_ids
+             if recipe_id in recipes],
+            many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+
+class TagViewSet(PrecomputedListMixin, viewsets.ReadOnlyModelViewSet):
     """Вью сет для тегов"""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    payload_version = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(PrecomputedListMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Вью сет для ингредиентов"""
 
     queryset = Ingredient.objects.all()
@@ -67,67 +201,154 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    payload_version = 'ingredients'
 
+    def list(self, request, *args, **kwargs):
+        """Поиск по названию обслуживается индексом в памяти"""
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(get_ingredient_index().search(
+            name, settings.INGREDIENT_SEARCH_LIMIT))
 
-class ShoppingCartAPIView(APIView):
-    """Вью сет для списка покупок"""
+
+class RecipeListAPIView(APIView):
+    """Базовый класс для добавления рецепта в список пользователя
+       и удаления из него. Добавление — одна вставка: повтор отсекает
+       уникальное ограничение, несуществующий рецепт — внешний ключ
+    """
 
     permission_classes = (IsAuthenticated,)
+    model = None
+    exists_message = None
+    removed_message = None
+    missing_message = None
 
     def post(self, request, recipe_id):
-        """Метод для добавления в избранное"""
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        if ShoppingCart.objects.filter(
-                user=request.user, recipe=recipe).exists():
-            return Response(
-                {'error': 'Вы уже добавили этот рецепт в корзину'},
-                status=status.HTTP_400_BAD_REQUEST)
-        recipe_in_cart = ShoppingCart.objects.create(
-            user=request.user, recipe=recipe)
-        serializer = RecipeSmallSerializer(recipe_in_cart.recipe)
+        try:
+            with transaction.atomic():
+                self.model.objects.create(
+                    user=request.user, recipe_id=recipe_id)
+        except IntegrityError as error:
+            if is_foreign_key_violation(error):
+                raise NotFound
+            return Response({'error': self.exists_message},
+                            status=status.HTTP_400_BAD_REQUEST)
+        serializer = RecipeSmallSerializer(
+            get_object_or_404(Recipe, id=recipe_id))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, recipe_id):
-        """Метод удаления рецепта из списка покупок"""
-        recipe_in_cart = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe_id)
-        if recipe_in_cart.exists():
-            recipe_in_cart.delete()
-            return Response({'message': 'Рецепт успешно удален из корзины'},
+        deleted, _ = self.model.objects.filter(
+            user=request.user, recipe=recipe_id).delete()
+        if deleted:
+            return Response({'message': self.removed_message},
                             status=status.HTTP_204_NO_CONTENT)
-        return Response({'message': 'Рецепта не было в корзине'},
-                        status=status.HTTP_400_BAD_REQUEST)
+        return Response({'message': self.missing_message},
+                        status=status.HTTP_404_NOT_FOUND)
 
 
-class FavoriteAPIView(APIView):
+class ShoppingCartAPIView(RecipeListAPIView):
+    """Вью сет для списка покупок"""
+
+    model = ShoppingCart
+    exists_message = 'Вы уже добавили этот рецепт в корзину'
+    removed_message = 'Рецепт успешно удален из корзины'
+    missing_message = 'Рецепта не было в корзине'
+
+
+class FavoriteAPIView(RecipeListAPIView):
     """Вью сет для избранного"""
 
-    permission_classes = (IsAuthenticated,)
+    model = Favorite
+    exists_message = 'Вы уже добавили этот рецепт в избранное'
+    removed_message = 'Рецепт успешно удален из избранного'
+    missing_message = 'Рецепта не было в избранном'
 
-    def post(self, request, recipe_id):
-        """Метод для добавления в избранное"""
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        if Favorite.objects.filter(
-                user=request.user, recipe=recipe).exists():
-            return Response(
-                {'error': 'Вы уже добавили этот рецепт в избранное'},
-                status=status.HTTP_400_BAD_REQUEST)
-        favorite_recipe = Favorite.objects.create(
-            user=request.user, recipe=recipe)
-        serializer = RecipeSmallSerializer(favorite_recipe.recipe)
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+class RecipeListBulkAPIView(APIView):
+    """Базовый класс для пакетного изменения списка рецептов
+       пользователя: добавление, удаление и очистка одним запросом
+    """
 
-    def delete(self, request, recipe_id):
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        favorite_recipe = Favorite.objects.filter(
-            user=request.user, recipe=recipe)
-        if favorite_recipe.exists():
-            favorite_recipe.delete()
-            return Response({'message': 'Рецепт успешно удален из избранного'},
-                            status=status.HTTP_204_NO_CONTENT)
-        return Response({'message': 'Рецепта не было в избранном'},
-                        status=status.HTTP_400_BAD_REQUEST)
+    permission_classes = (IsAuthenticated,)
+    model = None
+    counter = None
+
+    def get_recipe_ids(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data['recipes']))
+
+    def recipes_changed(self, user, recipe_ids, delta):
+        """Обновление счётчиков после добавления (delta=1)
+           или удаления (delta=-1) рецептов
+        """
+        change_counter(Recipe, self.counter, recipe_ids, delta)
+
+    def post(self, request):
+        """Добавление рецептов из списка recipes. Счётчики меняются
+           только по строкам, которые вставил этот запрос: параллельный
+           запрос с теми же рецептами не изменит их второй раз
+        """
+        recipe_ids = self.get_recipe_ids(request)
+        now = timezone.now()
+        with transaction.atomic():
+            found = set(Recipe.objects.filter(
+                pk__in=recipe_ids).values_list('id', flat=True))
+            added = insert_ignore_conflicts(
+                self.model, ('user', 'recipe', 'created'),
+                [(request.user.pk, recipe_id, now)
+                 for recipe_id in recipe_ids if recipe_id in found],
+                returning='recipe')
+            if added:
+                self.recipes_changed(request.user, added, 1)
+        statuses = dict.fromkeys(found, 'exists')
+        statuses.update(dict.fromkeys(added, 'added'))
+        return Response({'results': [
+            {'id': recipe_id, 'status': statuses.get(recipe_id, 'not_found')}
+            for recipe_id in recipe_ids]}, status=status.HTTP_200_OK)
+
+    def delete(self, request):
+        """Удаление рецептов из списка recipes или всех, если
+           список не передан. Счётчики меняются по строкам,
+           которые удалил этот запрос
+        """
+        recipe_ids = (self.get_recipe_ids(request)
+                      if 'recipes' in request.data else None)
+        with transaction.atomic():
+            queryset = self.model.objects.filter(user=request.user)
+            if recipe_ids is not None:
+                queryset = queryset.filter(recipe__in=recipe_ids)
+            removed = delete_returning(queryset, returning='recipe')
+            if removed:
+                self.recipes_changed(request.user, removed, -1)
+        if recipe_ids is None:
+            recipe_ids = removed
+        removed = set(removed)
+        return Response({'results': [
+            {'id': recipe_id,
+             'status': 'removed' if recipe_id in removed else 'not_found'}
+            for recipe_id in recipe_ids]}, status=status.HTTP_200_OK)
+
+
+class ShoppingCartBulkAPIView(RecipeListBulkAPIView):
+    """Пакетное изменение списка покупок"""
+
+    model = ShoppingCart
+    counter = 'cart_count'
+
+    def recipes_changed(self, user, recipe_ids, delta):
+        """Вместе со счётчиками меняется и список покупок"""
+        super().recipes_changed(user, recipe_ids, delta)
+        change_carts(user.pk, recipe_ids, delta)
+
+
+class FavoriteBulkAPIView(RecipeListBulkAPIView):
+    """Пакетное изменение избранного"""
+
+    model = Favorite
+    counter = 'favorites_count'
 
 
 class SubscribeAPIView(APIView):
@@ -137,32 +358,37 @@ class SubscribeAPIView(APIView):
 
     def post(self, request, user_id):
         """Метод для создания экземпляра подписки"""
+        recipes_limit = get_recipes_limit(request)
         author = get_object_or_404(User, id=user_id)
-        if self.request.user == author or Subscription.objects.filter(
-                user=request.user, author=user_id).exists():
-            return Response(
-                {'error': 'Вы пытаетесь подписаться на самого '
-                 'себя или уже подписаны на этого автора'},
-                status=status.HTTP_400_BAD_REQUEST)
-        subscription = Subscription.objects.create(
-            author=author, user=self.request.user)
+        error = Response(
+            {'error': 'Вы пытаетесь подписаться на самого '
+             'себя или уже подписаны на этого автора'},
+            status=status.HTTP_400_BAD_REQUEST)
+        if self.request.user == author:
+            return error
+        try:
+            with transaction.atomic():
+                subscription = Subscription.objects.create(
+                    author=author, user=self.request.user)
+        except IntegrityError:
+            return error
         serializer = SubscriptionsSerializer(
-            subscription, context={'request': request})
+            subscription, context={
+                'request': request, 'recipes_limit': recipes_limit})
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, user_id):
-        subscription = Subscription.objects.filter(
-            user=request.user, author=user_id)
-        if subscription.exists():
-            subscription.delete()
+        deleted, _ = Subscription.objects.filter(
+            user=request.user, author=user_id).delete()
+        if deleted:
             return Response({'message': 'Подписка успешно удалена'},
                             status=status.HTTP_204_NO_CONTENT)
         return Response({'message': 'У вас не было такой подписки'},
                         status=status.HTTP_400_BAD_REQUEST)
 
 
-class SubscriptionsListAPIView(ListAPIView):
+class SubscriptionsListAPIView(KeysetPaginationMixin, ListAPIView):
     """Вью класс для просмотра списка подписок"""
 
     serializer_class = SubscriptionsSerializer
@@ -170,4 +396,46 @@ class SubscriptionsListAPIView(ListAPIView):
     pagination_class = CustomPagination
 
     def get_queryset(self):
-        return self.request.user.subscriber.all()
+        return self.request.user.subscriber.select_related(
+            'author').order_by('id')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_limit'] = get_recipes_limit(self.request)
+        return context
+
+
+class ReadinessAPIView(APIView):
+    """Проверка готовности воркера принимать запросы"""
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        checks = {}
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            checks['database'] = 'ok'
+        except DatabaseError:
+            checks['database'] = 'error'
+        try:
+            get_version('recipes')
+            checks['cache'] = 'ok'
+        except OSError:
+            checks['cache'] = 'error'
+        ready = all(value == 'ok' for value in checks.values())
+        return Response(checks, status=(
+            status.HTTP_200_OK if ready
+            else status.HTTP_503_SERVICE_UNAVAILABLE))
+
+
+class MetricsAPIView(APIView):
+    """Метрики производительности в формате Prometheus"""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            render_prometheus(collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
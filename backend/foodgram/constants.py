@@ -1,3 +1,23 @@
 MIN_VALUE = 1
 MESSAGE_ERR_TIME = 'Время приготовления должно быть больше ноля.'
 MESSAGE_ERR_AMOUNT = 'Количество ингредиентов должно быть больше ноля.'
+IMAGE_VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+}
+IMAGE_VARIANT_FORMATS = ('webp',)
+BULK_RECIPES_LIMIT = 100
+# Версия записи токена в кеше аутентификации
+AUTH_TOKEN_VERSION = 'auth_token:{}'
+# Единицы, которые при подсчёте списка покупок переводятся в базовую:
+# единица -> (базовая единица, множитель)
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+# Крупная единица для вывода суммы в базовой единице:
+# базовая единица -> (крупная единица, множитель)
+READABLE_UNITS = {
+    'г': ('кг', 1000),
+    'мл': ('л', 1000),
+}
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.dispatch import receiver
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """Проверка постоянных соединений, простаивавших дольше
+       DB_HEALTH_CHECK_INTERVAL: оборванное соединение закрывается
+       до того, как запрос получит ошибку
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        idle = now - getattr(connection, 'last_request_finished', now)
+        if idle > settings.DB_HEALTH_CHECK_INTERVAL and (
+                not connection.is_usable()):
+            connection.close()
+
+
+@receiver(request_finished)
+def mark_connections(**kwargs):
+    now = time.monotonic()
+    for connection in connections.all():
+        connection.last_request_finished = now
@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_NAME = 'archive.json'
+FIELDS = ('count', 'seconds', 'queries', 'db_seconds', 'serializer_seconds')
+
+_local = threading.local()
+_registry = []
+_registry_lock = threading.Lock()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def new_stats():
+    stats = dict.fromkeys(FIELDS, 0)
+    stats['buckets'] = [0] * (len(BUCKETS) + 1)
+    return stats
+
+
+def get_thread_stats():
+    """Статистика текущего потока: каждый поток пишет только в свои
+       счётчики, блокировка нужна лишь при первой регистрации потока
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {}
+        with _registry_lock:
+            _registry.append(stats)
+    return stats
+
+
+def current_request():
+    """Замеры обрабатываемого потоком запроса или None"""
+    return getattr(_local, 'request', None)
+
+
+@contextmanager
+def measure_serialization():
+    """Замер времени сериализации. Учитывается только внешний
+       сериалайзер: вложенные уже входят в его время
+    """
+    measure = current_request()
+    if measure is None or measure['serializing']:
+        yield
+        return
+    measure['serializing'] = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        measure['serializer_seconds'] += time.perf_counter() - started
+        measure['serializing'] = False
+
+
+def record(key, seconds, measure):
+    stats = get_thread_stats()
+    entry = stats.get(key)
+    if entry is None:
+        entry = stats[key] = new_stats()
+    entry['count'] += 1
+    entry['seconds'] += seconds
+    entry['buckets'][bisect_left(BUCKETS, seconds)] += 1
+    for field in ('queries', 'db_seconds', 'serializer_seconds'):
+        entry[field] += measure[field]
+
+
+def merge(target, source):
+    for key, entry in source.items():
+        total = target.setdefault(key, new_stats())
+        for field in FIELDS:
+            # Файлы воркеров со старой версией могут не иметь поля
+            total[field] += entry.get(field, 0)
+        total['buckets'] = [
+            left + right
+            for left, right in zip(total['buckets'], entry['buckets'])]
+    return target
+
+
+def snapshot():
+    """Сумма статистики всех потоков процесса"""
+    with _registry_lock:
+        registry = list(_registry)
+    result = {}
+    for stats in registry:
+        merge(result, {key: dict(entry, buckets=list(entry['buckets']))
+                       for key, entry in list(stats.items())})
+    return result
+
+
+def flush(force=False):
+    """Запись статистики процесса в общий каталог METRICS_DIR,
+       не чаще раза в METRICS_FLUSH_INTERVAL секунд. Плановая запись
+       пропускается, если другой поток уже пишет файл
+    """
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        now = time.monotonic()
+        if not force and (
+                now - _last_flush < settings.METRICS_FLUSH_INTERVAL):
+            return
+        _last_flush = now
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        data = {'|'.join(key): entry for key, entry in snapshot().items()}
+        write(os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json'),
+              data)
+    finally:
+        _flush_lock.release()
+
+
+def write(path, data):
+    """Атомарная запись через собственный временный файл"""
+    descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as target:
+            json.dump(data, target)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read(path):
+    with open(path) as source:
+        return {tuple(key.split('|')): entry
+                for key, entry in json.load(source).items()}
+
+
+def archive_worker(pid):
+    """Перенос статистики завершившегося воркера в общий файл.
+       Файлы умерших воркеров не копятся, а суммы не уменьшаются
+    """
+    if not settings.METRICS_DIR:
+        return
+    path = os.path.join(settings.METRICS_DIR, f'{pid}.json')
+    archive = os.path.join(settings.METRICS_DIR, ARCHIVE_NAME)
+    try:
+        data = read(path)
+    except (OSError, ValueError):
+        return
+    try:
+        total = read(archive)
+    except (OSError, ValueError):
+        total = {}
+    merge(total, data)
+    write(archive, {'|'.join(key): entry for key, entry in total.items()})
+    os.remove(path)
+
+
+def collect():
+    """Статистика всех воркеров: из каталога METRICS_DIR или,
+       если он не задан, только текущего процесса
+    """
+    if not settings.METRICS_DIR:
+        return snapshot()
+    flush(force=True)
+    result = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            merge(result, read(os.path.join(settings.METRICS_DIR, name)))
+        except (OSError, ValueError):
+            continue
+    return result
+
+
+def render_prometheus(stats):
+    """Статистика в текстовом формате Prometheus"""
+    lines = [
+        '# HELP foodgram_request_seconds Request latency.',
+        '# TYPE foodgram_request_seconds histogram',
+    ]
+    items = sorted(stats.items())
+    for (endpoint, method), entry in items:
+        labels = f'endpoint="{endpoint}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, '+Inf'), entry['buckets']):
+            cumulative += count
+            lines.append(
+                f'foodgram_request_seconds_bucket{{{labels},le="{bound}"}} '
+                f'{cumulative}')
+        lines.append(
+            f'foodgram_request_seconds_sum{{{labels}}} {entry["seconds"]}')
+        lines.append(
+            f'foodgram_request_seconds_count{{{labels}}} {entry["count"]}')
+    for name, field, help_text in (
+            ('foodgram_request_queries_total', 'queries', 'SQL queries.'),
+            ('foodgram_request_db_seconds_total', 'db_seconds',
+             'Time spent in SQL queries.'),
+            ('foodgram_request_serializer_seconds_total',
+             'serializer_seconds', 'Time spent in serializer.data.')):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (endpoint, method), entry in items:
+            lines.append(
+                f'{name}{{endpoint="{endpoint}",method="{method}"}} '
+                f'{entry[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Замер времени ответа, числа и времени SQL-запросов
+       для каждого имени URL
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        measure = _local.request = {
+            'queries': 0, 'db_seconds': 0.0, 'serializer_seconds': 0.0,
+            'serializing': False}
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                measure['queries'] += 1
+                measure['db_seconds'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_query):
+                response = self.get_response(request)
+        finally:
+            _local.request = None
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unresolved'
+        record((endpoint, request.method), time.perf_counter() - started,
+               measure)
+        try:
+            flush()
+        except OSError:
+            # Метрики не должны ломать ответ
+            logging.exception('Не удалось записать метрики')
+        return response
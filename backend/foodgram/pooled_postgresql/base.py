@@ -0,0 +1,73 @@
+"""Бэкенд PostgreSQL с пулом соединений в процессе.
+
+Подключается через DB_ENGINE=foodgram.pooled_postgresql и рассчитан
+на воркеры с потоками: соединение берётся из пула при первом запросе
+к базе и возвращается в пул при закрытии, поэтому CONN_MAX_AGE
+для него должен быть равен 0.
+"""
+import os
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.db.backends.postgresql import base
+from psycopg2 import Error, pool
+
+_pools = {}
+_returned = {}
+_lock = Lock()
+
+
+def get_pool(alias, conn_params):
+    """Пул соединений для базы alias в текущем процессе"""
+    key = (os.getpid(), alias)
+    with _lock:
+        if key not in _pools:
+            _pools[key] = pool.ThreadedConnectionPool(
+                settings.DB_POOL_MIN_CONNECTIONS,
+                settings.DB_POOL_MAX_CONNECTIONS, **conn_params)
+        return _pools[key]
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.rollback()
+    except Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, settings_dict, *args, **kwargs):
+        settings_dict['CONN_MAX_AGE'] = 0
+        super().__init__(settings_dict, *args, **kwargs)
+
+    def get_new_connection(self, conn_params):
+        connections = get_pool(self.alias, conn_params)
+        while True:
+            connection = connections.getconn()
+            returned = _returned.pop(id(connection), None)
+            if not connection.closed and (
+                    returned is None
+                    or time.monotonic() - returned
+                    < settings.DB_HEALTH_CHECK_INTERVAL
+                    or is_usable(connection)):
+                break
+            connections.putconn(connection, close=True)
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            _returned[id(self.connection)] = time.monotonic()
+            get_pool(self.alias, self.get_connection_params()).putconn(
+                self.connection, close=bool(self.connection.closed))
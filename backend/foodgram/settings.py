@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +67,23 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        # Тестам с параллельными запросами на SQLite нужна база в файле
+        'TEST': {'NAME': os.getenv('DB_TEST_NAME')},
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+        },
     }
 }
 
@@ -91,7 +110,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -140,3 +159,44 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+IMAGE_PROCESSING_SYNC = os.getenv('IMAGE_PROCESSING_SYNC', '') == 'True'
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=600))
+RESPONSE_CACHE_LOCK_TIMEOUT = 5
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+
+# Индекс поиска по ингредиентам перестраивается в фоне, когда
+# исключённых из основных списков рецептов больше порога
+RECIPE_INDEX_MAX_EXCLUDED = 10000
+RECIPE_INDEX_CHANGES_RETENTION = 24 * 3600
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', default=10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', default=300))
+
+TRENDING_HALF_LIFE_HOURS = float(
+    os.getenv('TRENDING_HALF_LIFE_HOURS', default=24))
+TRENDING_WINDOW = 4
+# События последних секунд пересчитываются при каждом запуске:
+# транзакция с событием могла закоммититься позже его даты
+TRENDING_RESCAN = int(os.getenv('TRENDING_RESCAN', default=600))
+TRENDING_MIN_SCORE = 0.01
+TRENDING_WEIGHTS = {'favorite': 1.0, 'cart': 0.5}
+
+# Авторы с числом подписчиков от порога рассылают рецепты в ленты
+# подписчиков при публикации, 0 — рассылка выключена
+FEED_FANOUT_THRESHOLD = int(os.getenv('FEED_FANOUT_THRESHOLD', default=0))
+FEED_FANOUT_BATCH_SIZE = 1000
+# update_feed_fanout дорассылает рецепты, опубликованные с прошлого
+# запуска и за столько секунд до него
+FEED_FANOUT_RESCAN = 600
+
+DB_HEALTH_CHECK_INTERVAL = int(
+    os.getenv('DB_HEALTH_CHECK_INTERVAL', default=10))
+DB_POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN_CONNECTIONS', default=1))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', default=10))
+
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', default=10))
@@ -0,0 +1,25 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+
+VERSION_KEY = 'data-version:{}'
+
+
+def get_version(name):
+    """Текущая версия набора данных, общая для всех воркеров"""
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def peek_version(name):
+    """Версия набора данных без создания: None, пока набор не менялся"""
+    return cache.get(VERSION_KEY.format(name))
+
+
+def bump_version(name, timeout=None):
+    """Отмечает изменение набора данных новой версией"""
+    cache.set(VERSION_KEY.format(name), uuid4().hex, timeout)
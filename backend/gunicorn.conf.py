@@ -0,0 +1,49 @@
+"""Настройки gunicorn для продакшена.
+
+Число воркеров и потоков считается от числа процессоров,
+значения можно переопределить переменными окружения.
+"""
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', cpu_count * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Приложение загружается до форка: воркеры стартуют быстрее
+# и делят память с мастером
+preload_app = True
+
+# Воркер перезапускается после max_requests запросов, разброс
+# не даёт всем воркерам перезапуститься одновременно
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def pre_fork(server, worker):
+    """Соединения с базой, открытые мастером при загрузке
+       приложения, закрываются до форка, чтобы воркеры
+       не делили сокеты
+    """
+    from django.db import connections
+
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    """Статистика завершившегося воркера переносится в общий
+       файл метрик, чтобы файлы по pid не копились
+    """
+    from foodgram.metrics import archive_worker
+
+    archive_worker(worker.pid)
@@ -36,10 +36,10 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = ('in_favorite_count', 'in_cart_count', 'pub_date')
 
     def in_favorite_count(self, obj):
-        return obj.recipe_in_favorite.count()
+        return obj.favorites_count
 
     def in_cart_count(self, obj):
-        return obj.recipe_cart.count()
+        return obj.cart_count
 
     in_favorite_count.short_description = 'Пользователей, добавили в избранное:'
     in_cart_count.short_description = 'Пользователей, добавили в корзину:'
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from foodgram import db  # noqa: F401
+        from . import signals  # noqa: F401
@@ -0,0 +1,144 @@
+from datetime import date, datetime
+from io import StringIO
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def to_copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value).translate(COPY_ESCAPES)
+
+
+def insert_rows(model, columns, rows):
+    """Запись строк в таблицу модели: COPY на PostgreSQL,
+       пакетный INSERT на остальных базах
+    """
+    if not rows:
+        return
+    fields = [model._meta.get_field(column) for column in columns]
+    names = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = StringIO()
+            for row in rows:
+                buffer.write('\t'.join(map(to_copy_value, row)))
+                buffer.write('\n')
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {table} ({names}) FROM STDIN', buffer)
+            return
+        placeholders = ', '.join(['%s'] * len(fields))
+        cursor.executemany(
+            f'INSERT INTO {table} ({names}) VALUES ({placeholders})',
+            [[field.get_db_prep_save(value, connection)
+              for field, value in zip(fields, row)] for row in rows])
+
+
+def reserve_ids(model, count):
+    """Резервирование первичных ключей для последующей вставки"""
+    if count <= 0:
+        return []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                [model._meta.db_table, model._meta.pk.column, count])
+            return [row[0] for row in cursor.fetchall()]
+    start = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    return list(range(start, start + count))
+
+
+def is_foreign_key_violation(error):
+    """IntegrityError из-за внешнего ключа, а не уникальности"""
+    pgcode = getattr(error.__cause__, 'pgcode', None)
+    if pgcode is not None:
+        return pgcode == '23503'
+    return 'FOREIGN KEY' in str(error).upper()
+
+
+def supports_returning():
+    """Поддержка ON CONFLICT DO NOTHING и RETURNING базой"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 35)
+    return False
+
+
+def insert_ignore_conflicts(model, columns, rows, returning):
+    """Вставка строк с пропуском нарушающих уникальность. Возвращает
+       значения поля returning только у вставленных строк: это то,
+       что сделала сама вставка, а не прочитанное до неё
+    """
+    if not rows:
+        return []
+    fields = [model._meta.get_field(column) for column in columns]
+    if not supports_returning():
+        inserted = []
+        for row in rows:
+            values = {field.attname: value
+                      for field, value in zip(fields, row)}
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([model(**values)])
+            except IntegrityError:
+                continue
+            inserted.append(
+                values[model._meta.get_field(returning).attname])
+        return inserted
+    names = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(
+        model._meta.get_field(returning).column)
+    values = ', '.join(
+        ['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(rows))
+    params = [field.get_db_prep_save(value, connection)
+              for row in rows for field, value in zip(fields, row)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({names}) VALUES {values} '
+            f'ON CONFLICT DO NOTHING RETURNING {column}', params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(queryset, returning):
+    """Удаление строк запроса без сигналов. Возвращает значения
+       поля returning только у строк, удалённых этим запросом
+    """
+    model = queryset.model
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    if not supports_returning():
+        # Заблокированные строки не удалит параллельный запрос
+        rows = list(queryset.select_for_update().values_list(
+            'pk', returning))
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE {pk} IN '
+                    f'({", ".join(["%s"] * len(rows))})',
+                    [row_pk for row_pk, _ in rows])
+        return [value for _, value in rows]
+    column = connection.ops.quote_name(
+        model._meta.get_field(returning).column)
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {pk} IN ({sql}) '
+            f'RETURNING {column}', params)
+        return [row[0] for row in cursor.fetchall()]
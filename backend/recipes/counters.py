@@ -0,0 +1,48 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def change_counter(model, field, pks, delta):
+    """Атомарное изменение счётчика на delta у записей с pk из pks"""
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def lock_users(pks):
+    """Блокировка строк пользователей до конца транзакции. Изменения
+       списков рецептов одного пользователя и зависящих от них
+       счётчиков выполняются по очереди
+    """
+    from users.models import User
+
+    list(User.objects.select_for_update().filter(
+        pk__in=pks).order_by('pk').values_list('pk', flat=True))
+
+
+def recount(model, field, source, source_field, pk_range=None):
+    """Пересчёт счётчика по исходной таблице для диапазона pk"""
+    counts = source.objects.filter(
+        **{source_field: OuterRef('pk')}
+    ).order_by().values(source_field).annotate(
+        total=Count('pk')).values('total')
+    queryset = model.objects.all()
+    if pk_range is not None:
+        queryset = queryset.filter(pk__gte=pk_range[0], pk__lt=pk_range[1])
+    return queryset.update(**{field: Coalesce(
+        Subquery(counts, output_field=IntegerField()), 0)})
+
+
+def get_counters():
+    """Счётчики: модель, поле, исходная модель и её внешний ключ"""
+    from shopping_cart.models import ShoppingCart
+    from users.models import User
+    from .models import Favorite, Recipe, Subscription
+
+    return (
+        (Recipe, 'favorites_count', Favorite, 'recipe'),
+        (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'followers_count', Subscription, 'author'),
+    )
@@ -0,0 +1,76 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import FeedInbox, Recipe, Subscription
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='feed')
+
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def fan_out_recipe(recipe_id):
+    """Рассылка нового рецепта в ленты подписчиков автора,
+       если у автора включена рассылка
+    """
+    recipe = Recipe.objects.filter(
+        pk=recipe_id, author__feed_fanout=True).values(
+        'author_id', 'pub_date').first()
+    if recipe is None:
+        return
+    followers = list(Subscription.objects.filter(
+        author_id=recipe['author_id']).values_list('user_id', flat=True))
+    for batch in chunked(followers, settings.FEED_FANOUT_BATCH_SIZE):
+        FeedInbox.objects.bulk_create(
+            [FeedInbox(user_id=user_id, recipe_id=recipe_id,
+                       pub_date=recipe['pub_date'])
+             for user_id in batch], ignore_conflicts=True)
+
+
+def run_in_background(recipe_id):
+    try:
+        fan_out_recipe(recipe_id)
+    except Exception:
+        logging.exception(f'Не удалось разослать рецепт {recipe_id}')
+    finally:
+        connection.close()
+
+
+def schedule_fan_out(recipe_id):
+    """Постановка рассылки рецепта в очередь после коммита. Рецепты,
+       рассылка которых не успела выполниться, дорассылает
+       update_feed_fanout
+    """
+    transaction.on_commit(
+        lambda: _executor.submit(run_in_background, recipe_id))
+
+
+def wait_for_fan_out():
+    """Ожидание завершения фоновой рассылки"""
+    _executor.shutdown(wait=True)
+
+
+def backfill_inboxes(author_id, user_ids):
+    """Заполнение лент подписчиков user_ids рецептами автора"""
+    recipes = list(Recipe.objects.filter(
+        author_id=author_id).values_list('id', 'pub_date'))
+    rows = [FeedInbox(user_id=user_id, recipe_id=recipe_id,
+                      pub_date=pub_date)
+            for user_id in user_ids for recipe_id, pub_date in recipes]
+    for batch in chunked(rows, settings.FEED_FANOUT_BATCH_SIZE):
+        FeedInbox.objects.bulk_create(batch, ignore_conflicts=True)
+    return len(rows)
+
+
+def clear_inboxes(author_id, user_ids=None):
+    """Удаление рецептов автора из лент подписчиков"""
+    queryset = FeedInbox.objects.filter(recipe__author_id=author_id)
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    deleted, _ = queryset.delete()
+    return deleted
@@ -0,0 +1,105 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+
+from foodgram.constants import IMAGE_VARIANT_FORMATS, IMAGE_VARIANTS
+from foodgram.versioning import bump_version
+from .models import Recipe
+
+VARIANTS_DIR = 'recipes/variants/'
+PIL_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF',
+               'webp': 'WEBP'}
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images')
+
+
+def get_variant_names(image_name):
+    """Имена файлов всех уменьшенных копий изображения"""
+    stem, extension = os.path.splitext(os.path.basename(image_name))
+    extension = extension.lstrip('.').lower()
+    if extension not in PIL_FORMATS:
+        extension = 'jpg'
+    return {
+        f'{variant}_{image_format}' if image_format else variant:
+            f'{VARIANTS_DIR}{stem}_{variant}.{image_format or extension}'
+        for variant in IMAGE_VARIANTS
+        for image_format in (None, *IMAGE_VARIANT_FORMATS)
+    }
+
+
+def save_variant(image, name, size):
+    """Уменьшает изображение и сохраняет его под именем name"""
+    image_format = PIL_FORMATS[name.rsplit('.', 1)[-1]]
+    variant = image.copy()
+    variant.thumbnail(size)
+    if image_format == 'JPEG' and variant.mode not in ('RGB', 'L'):
+        variant = variant.convert('RGB')
+    buffer = BytesIO()
+    variant.save(buffer, image_format, optimize=True, quality=85)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_variants(recipe_id):
+    """Создание уменьшенных копий изображения рецепта"""
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return
+    image_name = recipe.image.name
+    with default_storage.open(image_name) as image_file:
+        image = Image.open(image_file)
+        image.load()
+    for variant, name in get_variant_names(image_name).items():
+        save_variant(image, name, IMAGE_VARIANTS[variant.split('_')[0]])
+    if Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+            image_variants_ready=True):
+        bump_version('recipes')
+
+
+def run_in_background(recipe_id):
+    try:
+        generate_variants(recipe_id)
+    except Exception:
+        logging.exception(
+            f'Не удалось обработать изображение рецепта {recipe_id}')
+    finally:
+        connection.close()
+
+
+def wait_for_background():
+    """Ожидание завершения фоновой обработки изображений"""
+    _executor.shutdown(wait=True)
+
+
+def schedule_variants(recipe_id):
+    """Постановка обработки изображения в очередь после коммита"""
+    if settings.IMAGE_PROCESSING_SYNC:
+        transaction.on_commit(lambda: generate_variants(recipe_id))
+    else:
+        transaction.on_commit(
+            lambda: _executor.submit(run_in_background, recipe_id))
+
+
+def get_variant_urls(recipe, request=None):
+    """Ссылки на уменьшенные копии или на оригинал, пока их нет"""
+    if not recipe.image:
+        return {}
+    names = get_variant_names(recipe.image.name)
+    if recipe.image_variants_ready:
+        urls = {variant: default_storage.url(name)
+                for variant, name in names.items()}
+    else:
+        urls = dict.fromkeys(names, recipe.image.url)
+    if request is not None:
+        urls = {variant: request.build_absolute_uri(url)
+                for variant, url in urls.items()}
+    return urls
@@ -0,0 +1,169 @@
+import logging
+import random
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from foodgram.versioning import bump_version
+from recipes.bulk import insert_rows, reserve_ids
+from recipes.counters import get_counters, recount
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            Subscription, Tag, TagRecipe)
+from shopping_cart.models import ShoppingCart
+from shopping_cart.shopping_list import rebuild
+from users.models import User
+
+logging.getLogger().setLevel(logging.INFO)
+
+EMAIL_DOMAIN = 'bench.foodgram'
+PASSWORD = 'benchmark-password'
+START_DATE = datetime(2022, 1, 1, tzinfo=timezone.utc)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+RECIPE_COLUMNS = ('id', 'author', 'name', 'image', 'image_variants_ready',
+                  'text', 'cooking_time', 'pub_date', 'favorites_count',
+                  'cart_count')
+
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class Command(BaseCommand):
+    """Команда для генерации воспроизводимого набора тестовых данных"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags-per-recipe', type=int, default=2)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок на пользователя')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя')
+        parser.add_argument('--cart', type=int, default=10,
+                            help='Рецептов в корзине на пользователя')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить ранее сгенерированных пользователей и их данные')
+
+    def handle(self, *args, **options):
+        generated = User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        if options['clear']:
+            deleted, _ = generated.delete()
+            logging.info(f'Удалено записей: {deleted}')
+        elif generated.exists():
+            raise CommandError(
+                'Тестовые данные уже есть, используйте --clear')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            ingredient_ids = self.ensure_ingredients(
+                options['ingredients_per_recipe'] * 10)
+            tag_ids = self.ensure_tags(options['tags_per_recipe'] + 1)
+            user_ids = self.create_users(options['users'])
+            recipe_ids = self.create_recipes(
+                user_ids, options['recipes'], ingredient_ids, tag_ids,
+                options['ingredients_per_recipe'], options['tags_per_recipe'])
+            self.create_links(Subscription, 'author', user_ids, user_ids,
+                              options['follows'])
+            self.create_links(Favorite, 'recipe', user_ids, recipe_ids,
+                              options['favorites'])
+            self.create_links(ShoppingCart, 'recipe', user_ids, recipe_ids,
+                              options['cart'])
+            for batch in chunked(user_ids, 1000):
+                rebuild(batch)
+            for model, field, source, source_field in get_counters():
+                recount(model, field, source, source_field)
+        for name in ('ingredients', 'tags', 'recipes', 'recipe_ingredients'):
+            bump_version(name)
+        logging.info(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}')
+
+    def ensure_ingredients(self, count):
+        """id ингредиентов; недостающие до count создаются"""
+        ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+        if len(ids) < count:
+            Ingredient.objects.bulk_create([
+                Ingredient(name=f'Ингредиент {number}',
+                           measurement_unit=UNITS[number % len(UNITS)])
+                for number in range(len(ids), count)
+            ])
+            ids = list(Ingredient.objects.order_by('id').values_list(
+                'id', flat=True))
+        return ids
+
+    def ensure_tags(self, count):
+        """id тегов; недостающие до count создаются"""
+        ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        if len(ids) < count:
+            Tag.objects.bulk_create([
+                Tag(name=f'Тег {number}', color=f'#{number:06x}',
+                    slug=f'bench-tag-{number}')
+                for number in range(len(ids), count)])
+            ids = list(Tag.objects.order_by('id').values_list(
+                'id', flat=True))
+        return ids
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(email=f'user{number}@{EMAIL_DOMAIN}',
+                 username=f'bench_user_{number}',
+                 first_name=f'Имя{number}', last_name=f'Фамилия{number}',
+                 password=password)
+            for number in range(count)
+        ])
+        return list(User.objects.filter(
+            email__endswith=f'@{EMAIL_DOMAIN}').order_by('id').values_list(
+            'id', flat=True))
+
+    def create_recipes(self, user_ids, count, ingredient_ids, tag_ids,
+                       ingredients_per_recipe, tags_per_recipe):
+        """Рецепты пишутся напрямую, как в import_recipes: bulk_create
+           заменил бы дату публикации текущим временем
+        """
+        recipe_ids = reserve_ids(Recipe, count)
+        sample = self.random.sample
+        for batch in chunked(list(enumerate(recipe_ids)), self.batch_size):
+            recipe_rows, tag_rows, ingredient_rows = [], [], []
+            for number, recipe_id in batch:
+                recipe_rows.append((
+                    recipe_id, self.random.choice(user_ids),
+                    f'Рецепт {number}', f'recipes/bench_{number % 100}.jpg',
+                    False, f'Описание рецепта {number}',
+                    self.random.randint(5, 180),
+                    START_DATE + timedelta(minutes=number), 0, 0))
+                tag_rows.extend(
+                    (recipe_id, tag_id) for tag_id in sample(
+                        tag_ids, min(tags_per_recipe, len(tag_ids))))
+                ingredient_rows.extend(
+                    (recipe_id, ingredient_id, self.random.randint(1, 500))
+                    for ingredient_id in sample(
+                        ingredient_ids,
+                        min(ingredients_per_recipe, len(ingredient_ids))))
+            insert_rows(Recipe, RECIPE_COLUMNS, recipe_rows)
+            insert_rows(TagRecipe, ('recipe', 'tag'), tag_rows)
+            insert_rows(IngredientRecipe, ('recipe', 'ingredient', 'amount'),
+                        ingredient_rows)
+        return recipe_ids
+
+    def create_links(self, model, field, user_ids, target_ids, per_user):
+        """Связи пользователей с авторами или рецептами"""
+        objects = []
+        for user_id in user_ids:
+            targets = self.random.sample(
+                target_ids, min(per_user, len(target_ids)))
+            if field == 'author' and user_id in targets:
+                targets.remove(user_id)
+            objects.extend(
+                model(user_id=user_id, **{f'{field}_id': target_id})
+                for target_id in targets)
+        model.objects.bulk_create(objects, ignore_conflicts=True)
@@ -0,0 +1,31 @@
+import logging
+
+from django.core.management import BaseCommand
+
+from recipes.images import generate_variants
+from recipes.models import Recipe
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    """Команда для создания уменьшенных копий изображений рецептов"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать копии и для уже обработанных рецептов')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants_ready=False)
+        processed = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            try:
+                generate_variants(recipe_id)
+            except (OSError, ValueError) as error:
+                logging.warning(f'Рецепт {recipe_id}: {error}')
+                continue
+            processed += 1
+        logging.info(f'Обработано изображений: {processed}')
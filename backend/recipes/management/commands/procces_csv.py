@@ -1,39 +1,129 @@
+import json
 import logging
 import os.path
 from csv import DictReader
+from hashlib import sha256
+from itertools import islice
 
 from django.core.management import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
-from recipes.models import Ingredient, Tag
+from foodgram.versioning import bump_version
+from recipes.models import Ingredient, SyncState, Tag
 
 DATA_DIR = 'data/'
 DATA_PATCH = {
     'ingredients': os.path.join(DATA_DIR, 'ingredients.csv'),
     'tags': os.path.join(DATA_DIR, 'tags.csv'),
 }
+SOURCES = {
+    'ingredients': (Ingredient, ('name', 'measurement_unit'),
+                    ('name', 'measurement_unit')),
+    'tags': (Tag, ('name', 'color', 'slug'), ('slug',)),
+}
+CHUNK_SIZE = 1000
 
 logging.getLogger().setLevel(logging.INFO)
 
 
+def file_checksum(path):
+    """Контрольная сумма содержимого файла"""
+    checksum = sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 16), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def read_rows(path):
+    """Строки CSV-файла или элементы JSON-массива"""
+    with open(path, encoding='utf-8') as source:
+        if path.endswith('.json'):
+            yield from json.load(source)
+        else:
+            yield from DictReader(source)
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def sync_by_id(model, fields, chunk):
+    """Вставка новых и обновление изменённых записей по id"""
+    existing = model.objects.in_bulk([int(row['id']) for row in chunk])
+    new, changed = [], []
+    for row in chunk:
+        values = {field: row[field] for field in fields}
+        obj = existing.get(int(row['id']))
+        if obj is None:
+            new.append(model(id=int(row['id']), **values))
+        elif any(getattr(obj, field) != value
+                 for field, value in values.items()):
+            for field, value in values.items():
+                setattr(obj, field, value)
+            changed.append(obj)
+    model.objects.bulk_create(new, ignore_conflicts=True)
+    model.objects.bulk_update(changed, fields)
+    return len(new), len(changed)
+
+
+def sync_by_key(model, fields, key, chunk):
+    """Вставка записей, которых ещё нет, по естественному ключу"""
+    existing = set(model.objects.filter(**{
+        f'{key[0]}__in': {row[key[0]] for row in chunk}
+    }).values_list(*key))
+    new = {}
+    for row in chunk:
+        row_key = tuple(row[field] for field in key)
+        if row_key not in existing:
+            new[row_key] = model(**{field: row[field] for field in fields})
+    model.objects.bulk_create(new.values(), ignore_conflicts=True)
+    return len(new), 0
+
+
 class Command(BaseCommand):
     """ Команда для загрузки данных в БД"""
 
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', default=DATA_PATCH['ingredients'],
+                            help='Файл ингредиентов: CSV или JSON')
+        parser.add_argument('--tags', default=DATA_PATCH['tags'])
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Загрузить файлы, даже если они не изменились')
+
     def handle(self, *args, **options):
-        Ingredient.objects.bulk_create(
-            [Ingredient(id=row['id'], name=row['name'],
-                        measurement_unit=row['measurement_unit'])
-             for row in DictReader(
-                open(DATA_PATCH['ingredients'], encoding='utf-8'))
-             ]
-        )
-
-        logging.info('База Ингредиентов загружена')
-
-        Tag.objects.bulk_create(
-            [Tag(id=row['id'], name=row['name'], color=row['color'],
-                 slug=row['slug'])
-             for row in DictReader(open(DATA_PATCH['tags'], encoding='utf-8'))
-             ]
-        )
-
-        logging.info('База Тегов загружена')
+        for source, (model, fields, key) in SOURCES.items():
+            path = options[source]
+            checksum = file_checksum(path)
+            state_name = f'procces_csv:{source}'
+            state = SyncState.objects.filter(name=state_name).first()
+            if state and state.value == checksum and not options['force']:
+                logging.info(f'{path} не изменился, загрузка пропущена')
+                continue
+            created = updated = 0
+            with transaction.atomic():
+                for chunk in chunks(read_rows(path), CHUNK_SIZE):
+                    if all(row.get('id') for row in chunk):
+                        result = sync_by_id(model, fields, chunk)
+                    else:
+                        result = sync_by_key(model, fields, key, chunk)
+                    created += result[0]
+                    updated += result[1]
+                self.reset_sequence(model)
+                SyncState.objects.update_or_create(
+                    name=state_name, defaults={'value': checksum})
+            bump_version(source)
+            logging.info(f'{path}: добавлено {created}, обновлено {updated}')
+
+    def reset_sequence(self, model):
+        """Сдвиг последовательности id после вставки с явными id"""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
@@ -0,0 +1,52 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+
+from recipes.counters import get_counters, recount
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def recount_batch(model, field, source, source_field, pk_range):
+    """Пересчёт одного пакета в отдельном потоке со своим соединением"""
+    try:
+        return recount(model, field, source, source_field, pk_range)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта денормализованных счётчиков"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers']
+        if connection.vendor == 'sqlite':
+            workers = 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for model, field, source, source_field in get_counters():
+                bounds = model.objects.aggregate(
+                    first=Min('pk'), last=Max('pk'))
+                if bounds['first'] is None:
+                    continue
+                pk_ranges = [
+                    (start, start + batch_size) for start in range(
+                        bounds['first'], bounds['last'] + 1, batch_size)]
+                if workers == 1:
+                    updated = sum(
+                        recount(model, field, source, source_field, pk_range)
+                        for pk_range in pk_ranges)
+                else:
+                    updated = sum(executor.map(
+                        lambda pk_range: recount_batch(
+                            model, field, source, source_field, pk_range),
+                        pk_ranges))
+                logging.info(
+                    f'{model.__name__}.{field} пересчитан: {updated} записей')
@@ -0,0 +1,403 @@
+import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from api.authentication import CachedTokenAuthentication
+from recipes.counters import change_counter
+from recipes.feed import backfill_inboxes, wait_for_fan_out
+from recipes.images import get_variant_names, wait_for_background
+from recipes.models import Ingredient, Recipe, Subscription, Tag
+from recipes.signals import batched_changes
+from shopping_cart.models import ShoppingCart
+from shopping_cart.shopping_list import rebuild
+from users.models import User
+from .generate_data import EMAIL_DOMAIN
+
+IN_PROCESS_SCENARIOS = ('token_auth', 'token_auth_cached')
+FEED_FOLLOWS = (10, 1000, 10000)
+CART_SIZES = (1, 10, 100)
+
+
+def make_image():
+    """Небольшое изображение в формате data URI для создания рецептов"""
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+class HttpClient:
+    """Клиент для замеров по HTTP на запущенном сервере с тем же
+       интерфейсом, что и у APIClient
+    """
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Authorization': f'Token {token}'} if token else {}
+        self.local = threading.local()
+
+    def request(self, method, path, data=None, format=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        url = self.base_url + path
+        if method == 'get':
+            response = session.get(url, params=data, headers=self.headers)
+        else:
+            response = session.request(
+                method, url, json=data, headers=self.headers)
+        response.data = (
+            response.json() if response.headers.get(
+                'Content-Type', '').startswith('application/json')
+            else None)
+        return response
+
+    def get(self, path, data=None):
+        return self.request('get', path, data)
+
+    def post(self, path, data=None, format=None):
+        return self.request('post', path, data)
+
+    def patch(self, path, data=None, format=None):
+        return self.request('patch', path, data)
+
+
+def percentile(values, fraction):
+    """Перцентиль по методу ближайшего ранга"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    """Команда для замера времени ответа и числа запросов
+       основных эндпоинтов API
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Запустить только указанные сценарии')
+        parser.add_argument('--label', default='',
+                            help='Метка прогона, например хеш коммита')
+        parser.add_argument('--output', help='Файл для результата в JSON')
+        parser.add_argument(
+            '--url', help='Адрес запущенного сервера, например '
+            'http://127.0.0.1:8000: запросы идут по HTTP, кроме числа '
+            'запросов к базе считаются запросы в секунду')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Число параллельных клиентов в режиме --url')
+
+    def handle(self, *args, **options):
+        self.prepare(options['url'])
+        scenarios = self.get_scenarios()
+        if options['url']:
+            for name in IN_PROCESS_SCENARIOS:
+                scenarios.pop(name)
+        selected = options['scenarios'] or list(scenarios)
+        unknown = set(selected) - set(scenarios)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        results = {}
+        try:
+            for name in selected:
+                if options['url']:
+                    results[name] = self.measure_http(
+                        scenarios[name], options['iterations'],
+                        options['warmup'], options['concurrency'])
+                else:
+                    results[name] = self.measure(
+                        scenarios[name], options['iterations'],
+                        options['warmup'])
+        finally:
+            self.cleanup()
+        report = json.dumps({
+            'label': options['label'],
+            'database': connection.vendor,
+            'url': options['url'],
+            'concurrency': options['concurrency'] if options['url'] else 1,
+            'iterations': options['iterations'],
+            'recipes': Recipe.objects.count(),
+            'users': User.objects.count(),
+            'scenarios': results,
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                target.write(report)
+        self.stdout.write(report)
+        self.check_cart_queries(results)
+
+    def prepare(self, url=None):
+        """Пользователь с подписками и корзиной и данные для запросов"""
+        users = User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        self.user = (users.order_by('id').first()
+                     or User.objects.order_by('id').first())
+        recipe = Recipe.objects.order_by('-pub_date', '-id').first()
+        if self.user is None or recipe is None:
+            raise CommandError('Нет данных, запустите generate_data')
+        self.recipe_id = recipe.id
+        token, _ = Token.objects.get_or_create(user=self.user)
+        if url:
+            self.anonymous = HttpClient(url)
+            self.client = HttpClient(url, token.key)
+        else:
+            self.anonymous = APIClient()
+            self.client = APIClient(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.auth_request = lambda: Request(RequestFactory().get(
+            '/', HTTP_AUTHORIZATION=f'Token {token.key}'))
+        self.tags = list(Tag.objects.values_list('id', 'slug')[:2])
+        self.ingredients = list(
+            Ingredient.objects.order_by('id').values_list('id', 'name')[:50])
+        self.image = make_image()
+        self.url = url
+        self.created = []
+        self.feed_clients = {}
+        self.feed_readers = []
+        self.feed_lock = threading.Lock()
+        self.cart_clients = {}
+        self.cart_readers = []
+        self.cart_lock = threading.Lock()
+        self.step = 0
+
+    def cleanup(self):
+        """Удаление созданных рецептов вместе с файлами изображений
+           и читателей ленты с их подписками
+        """
+        wait_for_background()
+        wait_for_fan_out()
+        for reader_id, author_ids in self.feed_readers:
+            with batched_changes():
+                Subscription.objects.filter(user_id=reader_id).delete()
+            change_counter(User, 'followers_count', author_ids, -1)
+            User.objects.filter(pk=reader_id).delete()
+        for reader_id, recipe_ids in self.cart_readers:
+            with batched_changes():
+                ShoppingCart.objects.filter(user_id=reader_id).delete()
+            change_counter(Recipe, 'cart_count', recipe_ids, -1)
+            User.objects.filter(pk=reader_id).delete()
+        for recipe in Recipe.objects.filter(id__in=self.created):
+            for name in get_variant_names(recipe.image.name).values():
+                default_storage.delete(name)
+            recipe.image.delete(save=False)
+            recipe.delete()
+
+    def get_scenarios(self):
+        tags = '&'.join(f'tags={slug}' for _, slug in self.tags)
+        return {
+            'recipes_list': lambda: self.anonymous.get(
+                f'/api/recipes/?page={self.step % 10 + 1}'),
+            'recipes_list_filtered': lambda: self.anonymous.get(
+                f'/api/recipes/?{tags}&page={self.step % 10 + 1}'),
+            'recipes_list_auth': lambda: self.client.get(
+                f'/api/recipes/?page={self.step % 10 + 1}'),
+            'recipes_list_auth_favorited': lambda: self.client.get(
+                '/api/recipes/?is_favorited=1'),
+            'recipe_retrieve': lambda: self.client.get(
+                f'/api/recipes/{self.recipe_id}/'),
+            'subscriptions': lambda: self.client.get(
+                '/api/users/subscriptions/?recipes_limit=3'),
+            'download_shopping_cart': lambda: self.client.get(
+                '/api/recipes/download_shopping_cart/'),
+            'ingredient_autocomplete': lambda: self.anonymous.get(
+                '/api/ingredients/', {'name': self.ingredient_prefix()}),
+            'users_me': lambda: self.client.get('/api/users/me/'),
+            'token_auth': lambda: TokenAuthentication().authenticate(
+                self.auth_request()),
+            'token_auth_cached': lambda: CachedTokenAuthentication(
+            ).authenticate(self.auth_request()),
+            'recipe_create': self.create_recipe,
+            'recipe_update': self.update_recipe,
+            **{f'feed_{follows}': self.feed_scenario(follows)
+               for follows in FEED_FOLLOWS},
+            **{f'download_shopping_cart_{size}': self.cart_scenario(size)
+               for size in CART_SIZES},
+        }
+
+    def cart_scenario(self, size):
+        return lambda: self.get_cart_client(size).get(
+            '/api/recipes/download_shopping_cart/')
+
+    def get_cart_client(self, size):
+        """Клиент покупателя с size рецептами в корзине. Покупатель
+           создаётся при первом запросе, во время прогрева
+        """
+        with self.cart_lock:
+            if size not in self.cart_clients:
+                self.cart_clients[size] = self.create_cart_client(size)
+        return self.cart_clients[size]
+
+    def create_cart_client(self, size):
+        reader = User.objects.create_user(
+            email=f'cart{size}@{EMAIL_DOMAIN}',
+            username=f'bench_cart_{size}', first_name='Покупатель',
+            last_name='Корзины', password=None)
+        recipe_ids = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True)[:size])
+        if len(recipe_ids) < size:
+            self.stderr.write(f'download_shopping_cart_{size}: доступно '
+                              f'только {len(recipe_ids)} рецептов')
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(user=reader, recipe_id=recipe_id)
+            for recipe_id in recipe_ids])
+        change_counter(Recipe, 'cart_count', recipe_ids, 1)
+        rebuild([reader.pk])
+        self.cart_readers.append((reader.pk, recipe_ids))
+        token = Token.objects.create(user=reader)
+        if self.url:
+            return HttpClient(self.url, token.key)
+        return APIClient(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def check_cart_queries(self, results):
+        """Число запросов скачивания списка покупок не должно расти
+           с размером корзины
+        """
+        queries = {
+            size: results[f'download_shopping_cart_{size}']['queries_max']
+            for size in CART_SIZES
+            if 'queries_max' in results.get(
+                f'download_shopping_cart_{size}', {})}
+        if len(set(queries.values())) > 1:
+            raise CommandError(
+                'Число запросов скачивания списка покупок растёт '
+                f'с размером корзины: {queries}')
+
+    def feed_scenario(self, follows):
+        return lambda: self.get_feed_client(follows).get(
+            '/api/recipes/feed/')
+
+    def get_feed_client(self, follows):
+        """Клиент читателя, подписанного на follows авторов с самым
+           большим числом рецептов. Читатель создаётся при первом
+           запросе, во время прогрева. Для 10 000 подписок нужен
+           набор данных generate_data --users 10001
+        """
+        with self.feed_lock:
+            if follows not in self.feed_clients:
+                self.feed_clients[follows] = self.create_feed_client(follows)
+        return self.feed_clients[follows]
+
+    def create_feed_client(self, follows):
+        reader = User.objects.create_user(
+            email=f'feed{follows}@{EMAIL_DOMAIN}',
+            username=f'bench_feed_{follows}', first_name='Читатель',
+            last_name='Ленты', password=None)
+        authors = list(User.objects.exclude(pk=reader.pk).order_by(
+            '-recipes_count', 'id').values_list('id', 'feed_fanout')[:follows])
+        if len(authors) < follows:
+            self.stderr.write(
+                f'feed_{follows}: доступно только {len(authors)} авторов')
+        author_ids = [author_id for author_id, _ in authors]
+        Subscription.objects.bulk_create([
+            Subscription(user=reader, author_id=author_id)
+            for author_id in author_ids])
+        change_counter(User, 'followers_count', author_ids, 1)
+        for author_id, feed_fanout in authors:
+            if feed_fanout:
+                backfill_inboxes(author_id, [reader.pk])
+        self.feed_readers.append((reader.pk, author_ids))
+        token = Token.objects.create(user=reader)
+        if self.url:
+            return HttpClient(self.url, token.key)
+        return APIClient(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def ingredient_prefix(self):
+        name = self.ingredients[self.step % len(self.ingredients)][1]
+        return name[:1 + self.step % 3]
+
+    def recipe_payload(self):
+        ingredients = self.ingredients[self.step % 10:self.step % 10 + 8]
+        return {
+            'name': f'Рецепт для замеров {self.step}',
+            'text': 'Описание',
+            'cooking_time': 10 + self.step % 50,
+            'tags': [tag_id for tag_id, _ in self.tags],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10 + self.step}
+                for ingredient_id, _ in ingredients],
+            'image': self.image,
+        }
+
+    def create_recipe(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_payload(), format='json')
+        if response.status_code == 201:
+            self.created.append(response.data['id'])
+        return response
+
+    def update_recipe(self):
+        if not self.created:
+            self.create_recipe()
+        payload = self.recipe_payload()
+        del payload['image']
+        return self.client.patch(
+            f'/api/recipes/{self.created[0]}/', payload, format='json')
+
+    def measure(self, scenario, iterations, warmup):
+        """Время ответа в мс и число SQL-запросов сценария"""
+        timings, queries, statuses = [], [], set()
+        for step in range(warmup + iterations):
+            self.step = step
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = scenario()
+                elapsed = time.perf_counter() - started
+            if step < warmup:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(len(context.captured_queries))
+            # Сценарии аутентификации возвращают пару (пользователь, токен)
+            statuses.add(getattr(response, 'status_code', 200))
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries_p50': percentile(queries, 0.5),
+            'queries_max': max(queries),
+            'statuses': sorted(statuses),
+        }
+
+    def measure_http(self, scenario, iterations, warmup, concurrency):
+        """Время ответа в мс и пропускная способность сценария
+           при concurrency параллельных клиентах
+        """
+        for step in range(warmup):
+            self.step = step
+            scenario()
+
+        def run(step):
+            self.step = step
+            started = time.perf_counter()
+            response = scenario()
+            return (time.perf_counter() - started) * 1000, response
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(
+                run, range(warmup, warmup + iterations * concurrency)))
+        elapsed = time.perf_counter() - started
+        timings = [timing for timing, _ in results]
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'requests_per_second': round(len(results) / elapsed, 1),
+            'statuses': sorted({
+                response.status_code for _, response in results}),
+        }
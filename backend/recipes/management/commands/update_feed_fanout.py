@@ -0,0 +1,71 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from recipes.feed import backfill_inboxes, clear_inboxes, fan_out_recipe
+from recipes.models import FeedInbox, Recipe, Subscription, SyncState
+from users.models import User
+
+logging.getLogger().setLevel(logging.INFO)
+
+STATE_NAME = 'update_feed_fanout'
+
+
+class Command(BaseCommand):
+    """Команда для включения рассылки в ленты у авторов с числом
+       подписчиков от порога и выключения у авторов, опустившихся
+       ниже половины порога. Половина порога не даёт рассылке
+       переключаться туда и обратно у авторов около границы.
+       Заодно дорассылает рецепты, фоновая рассылка которых
+       не выполнилась, и убирает из лент рецепты авторов без рассылки
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold', type=int, default=settings.FEED_FANOUT_THRESHOLD,
+            help='Число подписчиков для рассылки, 0 — выключить у всех')
+
+    def handle(self, *args, **options):
+        threshold = options['threshold']
+        started = timezone.now()
+        if threshold > 0:
+            enable = User.objects.filter(
+                feed_fanout=False, followers_count__gte=threshold)
+            disable = User.objects.filter(
+                feed_fanout=True, followers_count__lt=threshold / 2)
+        else:
+            enable = User.objects.none()
+            disable = User.objects.filter(feed_fanout=True)
+        # Флаг ставится до заполнения лент: рецепты, опубликованные
+        # после его установки, рассылаются сами, а заполнение
+        # повторно вставляет уже разосланные без ошибок
+        for author_id in enable.values_list('id', flat=True):
+            User.objects.filter(pk=author_id).update(feed_fanout=True)
+            followers = Subscription.objects.filter(
+                author_id=author_id).values_list('user_id', flat=True)
+            rows = backfill_inboxes(author_id, list(followers))
+            logging.info(f'Рассылка включена у автора {author_id}: {rows}')
+        for author_id in disable.values_list('id', flat=True):
+            User.objects.filter(pk=author_id).update(feed_fanout=False)
+            rows = clear_inboxes(author_id)
+            logging.info(f'Рассылка выключена у автора {author_id}: {rows}')
+        state = SyncState.objects.filter(name=STATE_NAME).first()
+        recipes = Recipe.objects.filter(author__feed_fanout=True)
+        if state:
+            recipes = recipes.filter(pub_date__gt=parse_datetime(
+                state.value) - timedelta(
+                seconds=settings.FEED_FANOUT_RESCAN))
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        for recipe_id in recipe_ids:
+            fan_out_recipe(recipe_id)
+        # Строки, вставленные рассылкой, начатой до снятия флага
+        deleted, _ = FeedInbox.objects.filter(
+            recipe__author__feed_fanout=False).delete()
+        SyncState.objects.update_or_create(
+            name=STATE_NAME, defaults={'value': started.isoformat()})
+        logging.info(f'Дорассылка рецептов: {len(recipe_ids)}, '
+                     f'удалено из лент: {deleted}')
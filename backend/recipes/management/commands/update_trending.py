@@ -0,0 +1,109 @@
+import logging
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from recipes.models import Favorite, Recipe, RecipeTrending, SyncState
+from shopping_cart.models import ShoppingCart
+
+logging.getLogger().setLevel(logging.INFO)
+
+STATE_NAME = 'update_trending'
+SOURCES = (
+    (Favorite, 'favorite'),
+    (ShoppingCart, 'cart'),
+)
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта рейтинга рецептов с экспоненциальным
+       затуханием. В base хранится вклад событий до отметки пересчёта
+       на момент отметки: при запуске он умножается на коэффициент
+       затухания и к нему добавляются события до новой отметки.
+       События после отметки (последние TRENDING_RESCAN секунд)
+       считаются заново при каждом запуске, поэтому учитываются
+       и закоммиченные позже своей даты
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--half-life', type=float,
+            default=settings.TRENDING_HALF_LIFE_HOURS,
+            help='Период полураспада веса события в часах')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересчитать рейтинг заново за последние часы')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        decay = math.log(2) / (options['half_life'] * 3600)
+        now = timezone.now()
+        mark = now - timedelta(seconds=settings.TRENDING_RESCAN)
+        state = SyncState.objects.filter(name=STATE_NAME).first()
+        watermark, folded = None, {}
+        if state and not options['rebuild']:
+            watermark = parse_datetime(state.value)
+        with transaction.atomic():
+            if watermark is None:
+                RecipeTrending.objects.all().delete()
+                watermark = mark - timedelta(
+                    hours=options['half_life'] * settings.TRENDING_WINDOW)
+            if mark > watermark:
+                RecipeTrending.objects.update(base=F('base') * math.exp(
+                    -decay * (mark - watermark).total_seconds()))
+                folded = self.collect_events(watermark, mark, decay)
+                self.save_scores(folded, 'base', options['batch_size'])
+                watermark = mark
+            RecipeTrending.objects.update(score=F('base') * math.exp(
+                -decay * (now - watermark).total_seconds()))
+            recent = self.collect_events(watermark, now, decay)
+            self.save_scores(recent, 'score', options['batch_size'])
+            deleted, _ = RecipeTrending.objects.filter(
+                score__lt=settings.TRENDING_MIN_SCORE).delete()
+            SyncState.objects.update_or_create(
+                name=STATE_NAME, defaults={'value': watermark.isoformat()})
+        logging.info(
+            f'Рейтинг обновлён на {now:%Y-%m-%d %H:%M:%S}: '
+            f'событий до отметки у {len(folded)} рецептов, после — '
+            f'у {len(recent)}, удалено {deleted}')
+
+    def collect_events(self, start, end, decay):
+        """Вклад событий из промежутка (start, end] на момент end"""
+        scores = defaultdict(float)
+        for model, kind in SOURCES:
+            weight = settings.TRENDING_WEIGHTS[kind]
+            events = model.objects.filter(
+                created__gt=start, created__lte=end,
+            ).values_list('recipe_id', 'created').iterator()
+            for recipe_id, created in events:
+                scores[recipe_id] += weight * math.exp(
+                    -decay * (end - created).total_seconds())
+        return scores
+
+    def save_scores(self, scores, field, batch_size):
+        """Добавление scores к полю field; у новых записей base
+           и score начинаются с нуля
+        """
+        recipe_ids = list(scores)
+        for start in range(0, len(recipe_ids), batch_size):
+            batch = recipe_ids[start:start + batch_size]
+            existing = RecipeTrending.objects.in_bulk(batch)
+            for recipe_id, trending in existing.items():
+                setattr(trending, field,
+                        getattr(trending, field) + scores[recipe_id])
+            RecipeTrending.objects.bulk_update(existing.values(), (field,))
+            # Рецепт мог быть удалён после события
+            alive = set(Recipe.objects.filter(
+                pk__in=set(batch) - existing.keys()
+            ).values_list('id', flat=True))
+            RecipeTrending.objects.bulk_create([
+                RecipeTrending(**{'recipe_id': recipe_id, 'score': 0,
+                                  field: scores[recipe_id]})
+                for recipe_id in alive])
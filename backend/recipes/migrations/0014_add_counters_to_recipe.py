@@ -0,0 +1,51 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:33
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    counters = (
+        ('recipes', 'Recipe', 'favorites_count', 'recipes', 'Favorite',
+         'recipe'),
+        ('recipes', 'Recipe', 'cart_count', 'shopping_cart', 'ShoppingCart',
+         'recipe'),
+        ('users', 'User', 'recipes_count', 'recipes', 'Recipe', 'author'),
+        ('users', 'User', 'followers_count', 'recipes', 'Subscription',
+         'author'),
+    )
+    for app, model, field, source_app, source, source_field in counters:
+        counts = apps.get_model(source_app, source).objects.filter(
+            **{source_field: OuterRef('pk')}
+        ).order_by().values(source_field).annotate(
+            total=Count('pk')).values('total')
+        apps.get_model(app, model).objects.update(**{field: Coalesce(
+            Subquery(counts, output_field=IntegerField()), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_add_pub_date_id_index_to_recipe'),
+        ('shopping_cart', '0003_added_related_name_to_cart'),
+        ('users', '0003_add_counters_to_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Добавлений в корзину'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
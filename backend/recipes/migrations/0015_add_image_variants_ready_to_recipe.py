@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_add_counters_to_recipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants_ready',
+            field=models.BooleanField(default=False, verbose_name='Уменьшенные копии изображения готовы'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:52
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_created(apps, schema_editor):
+    """Время добавления старых записей неизвестно, берётся дата
+       публикации рецепта, чтобы они не считались свежими событиями
+    """
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite.objects.update(created=Subquery(
+        Recipe.objects.filter(pk=OuterRef('recipe')).values('pub_date')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_add_recipe_full_text_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeTrending',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='recipes.Recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(verbose_name='Рейтинг')),
+            ],
+            options={
+                'verbose_name': 'Trending recipe',
+                'verbose_name_plural': 'Trending recipes',
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipetrending',
+            index=models.Index(fields=['-score', '-recipe'], name='recipe_trending_score_idx'),
+        ),
+    ]
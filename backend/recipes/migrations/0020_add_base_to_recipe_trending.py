@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:07
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_score(apps, schema_editor):
+    """Рейтинг посчитан на момент отметки пересчёта"""
+    RecipeTrending = apps.get_model('recipes', 'RecipeTrending')
+    RecipeTrending.objects.update(base=F('score'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_add_feed_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipetrending',
+            name='base',
+            field=models.FloatField(default=0, verbose_name='Рейтинг по событиям до отметки пересчёта'),
+        ),
+        migrations.RunPython(copy_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_add_base_to_recipe_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeIngredientChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.PositiveIntegerField(verbose_name='id рецепта')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Recipe ingredient change',
+                'verbose_name_plural': 'Recipe ingredient changes',
+            },
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 
 from foodgram.constants import MESSAGE_ERR_AMOUNT, MESSAGE_ERR_TIME, MIN_VALUE
 from users.models import User
@@ -35,6 +37,30 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeManager(models.Manager):
+    """Менеджер рецептов"""
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """Последние рецепты авторов, не более limit на каждого автора,
+           одним запросом с оконной функцией. Колонки берутся из модели
+        """
+        author_ids = list(author_ids)
+        if limit is None or not author_ids:
+            return self.filter(author_id__in=author_ids)
+        ranked = self.filter(author_id__in=author_ids).annotate(
+            row_number=Window(
+                RowNumber(), partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()]),
+        ).order_by()
+        sql, params = ranked.query.sql_with_params()
+        columns = ', '.join(connection.ops.quote_name(field.column)
+                            for field in self.model._meta.concrete_fields)
+        return self.raw(
+            f'SELECT {columns} FROM ({sql}) AS ranked '
+            f'WHERE row_number <= %s ORDER BY pub_date DESC, id DESC',
+            [*params, limit])
+
+
 class Recipe(models.Model):
     """Модель рецептов"""
 
@@ -45,6 +71,8 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Изображение', upload_to='recipes/',
         help_text='Загрузите изображение')
+    image_variants_ready = models.BooleanField(
+        verbose_name='Уменьшенные копии изображения готовы', default=False)
     text = models.TextField(verbose_name='Описание рецепта')
     ingredients = models.ManyToManyField(
         Ingredient, through='IngredientRecipe')
@@ -54,9 +82,29 @@ class Recipe(models.Model):
     tags = models.ManyToManyField(Tag, through='TagRecipe')
     pub_date = models.DateTimeField(
         auto_now_add=True, verbose_name='Дата публикации')
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное', default=0)
+    cart_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в корзину', default=0)
+
+    objects = RecipeManager()
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_popular_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+        ]
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
 
@@ -89,6 +137,24 @@ class IngredientRecipe(models.Model):
         return f'{self.recipe} - {self.ingredient}'
 
 
+class RecipeIngredientChange(models.Model):
+    """Модель журнала рецептов, у которых строки состава удалялись
+       или менялись. По журналу индекс поиска по ингредиентам
+       обновляет такие рецепты без полной перестройки
+    """
+
+    recipe_id = models.PositiveIntegerField(verbose_name='id рецепта')
+    created = models.DateTimeField(
+        verbose_name='Дата изменения', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Recipe ingredient change'
+        verbose_name_plural = 'Recipe ingredient changes'
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.created}'
+
+
 class TagRecipe(models.Model):
     """Модель тегов определённого рецепта"""
 
@@ -116,6 +182,8 @@ class Favorite(models.Model):
     recipe = models.ForeignKey(
         Recipe, verbose_name='Избранный рецепт', on_delete=models.CASCADE,
         related_name='recipe_in_favorite')
+    created = models.DateTimeField(
+        verbose_name='Дата добавления', auto_now_add=True, db_index=True)
 
     class Meta:
         constraints = [models.UniqueConstraint(
@@ -149,3 +217,77 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f'{self.user} - {self.author}'
+
+
+class FeedInbox(models.Model):
+    """Модель ленты подписчика: рецепты авторов с рассылкой
+       при публикации (User.feed_fanout)
+    """
+
+    user = models.ForeignKey(
+        User, verbose_name='Подписчик', on_delete=models.CASCADE,
+        related_name='feed_inbox')
+    recipe = models.ForeignKey(
+        Recipe, verbose_name='Рецепт', on_delete=models.CASCADE,
+        related_name='feed_inbox')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'],
+            name='unique_feed_inbox',
+        )]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_inbox_user_pub_date_idx',
+            ),
+        ]
+        verbose_name = 'Feed inbox'
+        verbose_name_plural = 'Feed inboxes'
+
+    def __str__(self):
+        return f'{self.recipe} в ленте у {self.user}'
+
+
+class RecipeTrending(models.Model):
+    """Модель рейтинга рецептов по недавним добавлениям
+       в избранное и корзину, пересчитывается командой update_trending
+    """
+
+    recipe = models.OneToOneField(
+        Recipe, verbose_name='Рецепт', on_delete=models.CASCADE,
+        primary_key=True, related_name='trending')
+    score = models.FloatField(verbose_name='Рейтинг')
+    base = models.FloatField(
+        verbose_name='Рейтинг по событиям до отметки пересчёта', default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-score', '-recipe'],
+                name='recipe_trending_score_idx',
+            ),
+        ]
+        verbose_name = 'Trending recipe'
+        verbose_name_plural = 'Trending recipes'
+
+    def __str__(self):
+        return f'{self.recipe}: {self.score:.2f}'
+
+
+class SyncState(models.Model):
+    """Модель состояния служебных загрузок и пересчётов"""
+
+    name = models.CharField(verbose_name='Процесс', max_length=255,
+                            unique=True)
+    value = models.CharField(verbose_name='Значение', max_length=255)
+    updated_at = models.DateTimeField(
+        verbose_name='Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Sync state'
+        verbose_name_plural = 'Sync states'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
@@ -0,0 +1,44 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+WORD = re.compile(r'\w+')
+
+
+def search_recipes(queryset, query):
+    """Полнотекстовый поиск по названию и описанию рецептов.
+       Результат аннотирован релевантностью search_rank.
+    """
+    words = WORD.findall(query)
+    if not words:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        text_query = ' '.join(words)
+        queryset = queryset.extra(
+            where=["recipes_recipe.search_vector @@ "
+                   "plainto_tsquery('pg_catalog.russian', %s)"],
+            params=[text_query])
+        rank = RawSQL(
+            "ts_rank(recipes_recipe.search_vector, "
+            "plainto_tsquery('pg_catalog.russian', %s))",
+            (text_query,), output_field=FloatField())
+    elif connection.vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        queryset = queryset.extra(
+            where=['recipes_recipe.id IN (SELECT rowid FROM '
+                   'recipes_recipe_fts WHERE recipes_recipe_fts MATCH %s)'],
+            params=[match])
+        rank = RawSQL(
+            'SELECT -bm25(recipes_recipe_fts) FROM recipes_recipe_fts '
+            'WHERE recipes_recipe_fts MATCH %s '
+            'AND rowid = recipes_recipe.id',
+            (match,), output_field=FloatField())
+    else:
+        for word in words:
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(text__icontains=word))
+        rank = RawSQL('0', (), output_field=FloatField())
+    return queryset.annotate(search_rank=rank).order_by(
+        '-search_rank', '-pub_date', '-id')
@@ -0,0 +1,231 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from foodgram.constants import AUTH_TOKEN_VERSION
+from foodgram.versioning import bump_version
+from shopping_cart.models import ShoppingCart
+from shopping_cart.shopping_list import change_carts, change_recipe
+from users.models import User
+from .counters import change_counter
+from .feed import backfill_inboxes, clear_inboxes, schedule_fan_out
+from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                     RecipeIngredientChange, Subscription, Tag, TagRecipe)
+
+_state = threading.local()
+
+
+@contextmanager
+def batched_changes():
+    """Приёмники счётчиков, списка покупок и журнала состава
+       рецептов пропускают изменения внутри блока: вызывающий код
+       обновляет их сам одним пакетом
+    """
+    previous = is_batched()
+    _state.batched = True
+    try:
+        yield
+    finally:
+        _state.batched = previous
+
+
+def is_batched():
+    return getattr(_state, 'batched', False)
+
+
+def get_deleting_recipes():
+    """id рецептов, удаляемых в текущем потоке"""
+    if not hasattr(_state, 'deleting_recipes'):
+        _state.deleting_recipes = set()
+    return _state.deleting_recipes
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(sender, **kwargs):
+    """Смена версии справочника ингредиентов"""
+    bump_version('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(sender, **kwargs):
+    """Смена версии справочника тегов"""
+    bump_version('tags')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=TagRecipe)
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=User)
+def recipes_changed(sender, update_fields=None, **kwargs):
+    """Смена версии данных, из которых строятся ответы по рецептам"""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_version('recipes')
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def recipe_ingredients_changed(sender, instance, created=False, **kwargs):
+    """Смена версии состава рецептов. Удалённая или изменённая строка
+       записывается в журнал, по которому индекс перечитывает рецепт
+    """
+    if not (created or is_batched()
+            or instance.recipe_id in get_deleting_recipes()):
+        RecipeIngredientChange.objects.create(recipe_id=instance.recipe_id)
+    bump_version('recipe_ingredients')
+
+
+def evict_tokens(keys):
+    """Сброс записей токенов в кеше аутентификации всех воркеров.
+       Версия живёт не дольше записи кеша
+    """
+    for key in keys:
+        bump_version(AUTH_TOKEN_VERSION.format(key),
+                     settings.AUTH_TOKEN_CACHE_TTL)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    """Запоминание прежних пароля и активности пользователя"""
+    instance._previous_credentials = None
+    if instance.pk is not None and (
+            update_fields is None
+            or set(update_fields) & {'password', 'is_active'}):
+        instance._previous_credentials = User.objects.filter(
+            pk=instance.pk).values_list('password', 'is_active').first()
+
+
+@receiver(post_save, sender=User)
+def user_credentials_changed(sender, instance, **kwargs):
+    """Смена пароля или деактивация сбрасывает токены пользователя"""
+    previous = getattr(instance, '_previous_credentials', None)
+    if previous is not None and previous != (
+            instance.password, instance.is_active):
+        evict_tokens(Token.objects.filter(
+            user=instance).values_list('key', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Token)
+def token_changed(sender, instance, created=False, **kwargs):
+    """Выход, удаление пользователя вместе с токеном или передача
+       токена другому пользователю сбрасывают этот токен
+    """
+    if not created:
+        evict_tokens((instance.key,))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    """Рассылка рецепта в ленты подписчиков в фоне после коммита.
+       Флаг автора читается там же из базы: request.user может быть
+       взят из кеша аутентификации
+    """
+    if created:
+        schedule_fan_out(instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(sender, instance, created, **kwargs):
+    """Новый подписчик автора с рассылкой получает его рецепты"""
+    if created and User.objects.filter(
+            pk=instance.author_id, feed_fanout=True).exists():
+        backfill_inboxes(instance.author_id, [instance.user_id])
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    """Рецепты автора с рассылкой убираются из ленты отписавшегося"""
+    if User.objects.filter(pk=instance.author_id, feed_fanout=True).exists():
+        clear_inboxes(instance.author_id, [instance.user_id])
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_recipe_added(sender, instance, created, **kwargs):
+    """Ингредиенты рецепта добавляются в список покупок"""
+    if created and not is_batched():
+        change_carts(instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def cart_recipe_removed(sender, instance, **kwargs):
+    """Ингредиенты рецепта вычитаются из списка покупок. Вызывается
+       до удаления: при удалении рецепта его ингредиенты ещё на месте
+    """
+    if not is_batched():
+        change_carts(instance.user_id, [instance.recipe_id], -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    """Удаляемый рецепт уходит из списков покупок через приёмник
+       корзины, удаление строк его состава списки не меняет
+    """
+    get_deleting_recipes().add(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Удалённый рецепт один раз записывается в журнал состава"""
+    get_deleting_recipes().discard(instance.pk)
+    RecipeIngredientChange.objects.create(recipe_id=instance.pk)
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def recipe_ingredient_saving(sender, instance, **kwargs):
+    """Запоминание прежнего ингредиента и количества строки состава"""
+    instance._previous = None
+    if instance.pk is not None and not is_batched():
+        instance._previous = IngredientRecipe.objects.filter(
+            pk=instance.pk).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def recipe_ingredient_saved(sender, instance, **kwargs):
+    """Изменение состава рецепта в обход API, например в админке,
+       переносится в списки покупок
+    """
+    if is_batched():
+        return
+    changes = defaultdict(int)
+    if instance._previous is not None:
+        ingredient_id, amount = instance._previous
+        changes[ingredient_id] -= amount
+    changes[instance.ingredient_id] += instance.amount
+    change_recipe(instance.recipe_id, changes)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    if is_batched() or instance.recipe_id in get_deleting_recipes():
+        return
+    change_recipe(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount})
+
+
+def counter_receiver(sender, model, field, related_field):
+    """Подключение счётчика model.field к созданию и удалению sender"""
+
+    def on_save(instance, created, **kwargs):
+        if created and not is_batched():
+            change_counter(
+                model, field, [getattr(instance, related_field)], 1)
+
+    def on_delete(instance, **kwargs):
+        if not is_batched():
+            change_counter(
+                model, field, [getattr(instance, related_field)], -1)
+
+    post_save.connect(on_save, sender=sender, weak=False)
+    post_delete.connect(on_delete, sender=sender, weak=False)
+
+
+counter_receiver(Favorite, Recipe, 'favorites_count', 'recipe_id')
+counter_receiver(ShoppingCart, Recipe, 'cart_count', 'recipe_id')
+counter_receiver(Recipe, User, 'recipes_count', 'author_id')
+counter_receiver(Subscription, User, 'followers_count', 'author_id')
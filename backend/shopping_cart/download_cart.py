@@ -1,28 +1,58 @@
-from collections import defaultdict
+from decimal import Decimal
 
-from recipes.models import IngredientRecipe
+from django.db.models import Case, CharField, F, IntegerField, Sum, Value, When
 
+from foodgram.constants import READABLE_UNITS, UNIT_CONVERSIONS
+from .models import ShoppingListItem
 
-def download_ingredients(user):
-    """Метод для формирования списка покупок"""
-    ingredients = defaultdict(int)
-    ingredient_recipes = IngredientRecipe.objects.filter(
-        recipe__recipe_cart__user=user)
 
-    for ingredient_recipe in ingredient_recipes:
-        name = ingredient_recipe.ingredient.name
-        measurement_unit = ingredient_recipe.ingredient.measurement_unit
-        ingredient = f'{name}, {measurement_unit}'
-        amount = ingredient_recipe.amount
-        ingredients[ingredient] += amount
+def canonical_unit(unit_field):
+    """Выражение базовой единицы измерения поля unit_field"""
+    return Case(
+        *(When(**{unit_field: unit}, then=Value(base))
+          for unit, (base, _) in UNIT_CONVERSIONS.items()),
+        default=F(unit_field), output_field=CharField())
+
 
-    ingredients_to_file = 'Список покупок:\n'
-    count = 1
+def canonical_amount(amount_field, unit_field):
+    """Выражение количества amount_field в базовой единице"""
+    return Case(
+        *(When(**{unit_field: unit}, then=F(amount_field) * factor)
+          for unit, (_, factor) in UNIT_CONVERSIONS.items()),
+        default=F(amount_field), output_field=IntegerField())
 
-    for key, value in ingredients.items():
-        ingredients_to_file += f'{count}. {key} - {value}\n'
-        count += 1
 
-    ingredients_to_file += '\n\n Foodgram ©'
+def format_amount(total, unit):
+    """Сумма в наиболее удобной для чтения единице"""
+    if unit in READABLE_UNITS:
+        readable, factor = READABLE_UNITS[unit]
+        if total >= factor:
+            amount = (Decimal(total) / factor).quantize(Decimal('0.001'))
+            return f'{amount.normalize():f}', readable
+    return str(total), unit
 
-    return ingredients_to_file
+
+def download_ingredients(user):
+    """Метод для формирования списка покупок из готовых итогов
+       по ингредиентам. Количества одного ингредиента в разных
+       единицах (г и кг, мл и л) переводятся в базовую единицу
+       и складываются
+    """
+    ingredients = ShoppingListItem.objects.filter(
+        user=user
+    ).annotate(
+        unit=canonical_unit('ingredient__measurement_unit')
+    ).values(
+        'ingredient__name', 'unit'
+    ).annotate(
+        total=Sum(canonical_amount('amount', 'ingredient__measurement_unit'))
+    ).order_by('ingredient__name', 'unit')
+
+    lines = ['Список покупок:']
+    for count, ingredient in enumerate(ingredients, start=1):
+        amount, unit = format_amount(ingredient['total'], ingredient['unit'])
+        lines.append(f'{count}. {ingredient["ingredient__name"]}, '
+                     f'{unit} - {amount}')
+    lines.append('\n\n Foodgram ©')
+
+    return '\n'.join(lines)
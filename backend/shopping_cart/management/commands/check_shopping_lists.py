@@ -0,0 +1,44 @@
+import logging
+
+from django.core.management import BaseCommand, CommandError
+
+from shopping_cart.models import ShoppingCart, ShoppingListItem
+from shopping_cart.shopping_list import compute_totals, get_totals, rebuild
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    """Команда для сверки таблицы списков покупок с полным пересчётом
+       по корзинам. Расхождения появляются при записи корзин и состава
+       рецептов в обход сигналов: update(), bulk-операции, SQL
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Пользователей в одном пакете')
+        parser.add_argument('--fix', action='store_true',
+                            help='Пересчитать списки с расхождениями')
+
+    def handle(self, *args, **options):
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list('user_id', flat=True))
+            | set(ShoppingListItem.objects.values_list('user_id', flat=True)))
+        batch_size = options['batch_size']
+        mismatched = []
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            expected, actual = compute_totals(batch), get_totals(batch)
+            broken = sorted({
+                key[0] for key in expected.keys() | actual.keys()
+                if expected.get(key) != actual.get(key)})
+            if broken and options['fix']:
+                rebuild(broken)
+            mismatched.extend(broken)
+        logging.info(
+            f'Проверено списков: {len(user_ids)}, '
+            f'с расхождениями: {len(mismatched)}')
+        if mismatched and not options['fix']:
+            raise CommandError(
+                'Списки покупок расходятся с корзинами у пользователей: '
+                + ', '.join(map(str, mismatched[:20])))
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:42
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicates(apps, schema_editor):
+    ShoppingCart = apps.get_model('shopping_cart', 'ShoppingCart')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    duplicates = ShoppingCart.objects.values('user', 'recipe').order_by(
+    ).annotate(first_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    recipe_ids = set()
+    for duplicate in duplicates:
+        ShoppingCart.objects.filter(
+            user=duplicate['user'], recipe=duplicate['recipe'],
+        ).exclude(id=duplicate['first_id']).delete()
+        recipe_ids.add(duplicate['recipe'])
+    if recipe_ids:
+        counts = ShoppingCart.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            total=Count('pk')).values('total')
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            cart_count=Coalesce(
+                Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_add_counters_to_recipe'),
+        ('shopping_cart', '0003_added_related_name_to_cart'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_cart'),
+        ),
+    ]
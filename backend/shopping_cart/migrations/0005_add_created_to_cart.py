@@ -0,0 +1,32 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:52
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+
+
+def backfill_created(apps, schema_editor):
+    """Время добавления старых записей неизвестно, берётся дата
+       публикации рецепта, чтобы они не считались свежими событиями
+    """
+    ShoppingCart = apps.get_model('shopping_cart', 'ShoppingCart')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    ShoppingCart.objects.update(created=Subquery(
+        Recipe.objects.filter(pk=OuterRef('recipe')).values('pub_date')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping_cart', '0004_add_unique_constraint_to_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+    ]
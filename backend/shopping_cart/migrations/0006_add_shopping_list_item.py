@@ -0,0 +1,50 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:58
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingListItem = apps.get_model('shopping_cart', 'ShoppingListItem')
+    totals = IngredientRecipe.objects.filter(
+        recipe__recipe_cart__isnull=False,
+    ).values('recipe__recipe_cart__user', 'ingredient').order_by(
+    ).annotate(total=Sum('amount')).iterator()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=row['recipe__recipe_cart__user'],
+            ingredient_id=row['ingredient'], amount=row['total'])
+        for row in totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_add_feed_inbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shopping_cart', '0005_add_created_to_cart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='recipes.Ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Юзер')),
+            ],
+            options={
+                'verbose_name': 'Shopping list item',
+                'verbose_name_plural': 'Shopping list items',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 
-from recipes.models import Recipe
+from recipes.models import Ingredient, Recipe
 from users.models import User
 
 
@@ -19,10 +19,47 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='recipe_cart',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления', auto_now_add=True, db_index=True)
 
     class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'],
+            name='unique_cart',
+        )]
         verbose_name = 'Shopping cart'
         verbose_name_plural = 'Shopping carts'
 
     def __str__(self):
         return f'{self.recipe} в корзине у {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """Модель итогового количества ингредиента в списке покупок.
+       Обновляется разницей при изменении корзины и состава рецептов
+    """
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Юзер',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shopping_list_item',
+        )]
+        verbose_name = 'Shopping list item'
+        verbose_name_plural = 'Shopping list items'
+
+    def __str__(self):
+        return f'{self.ingredient} в списке покупок у {self.user}'
@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.counters import lock_users
+from recipes.models import IngredientRecipe
+from .models import ShoppingCart, ShoppingListItem
+
+
+def compute_totals(user_ids):
+    """Полный пересчёт списка покупок: {(user_id, ingredient_id): amount}"""
+    totals = IngredientRecipe.objects.filter(
+        recipe__recipe_cart__user__in=user_ids,
+    ).values('recipe__recipe_cart__user', 'ingredient').order_by(
+    ).annotate(total=Sum('amount'))
+    return {(row['recipe__recipe_cart__user'], row['ingredient']):
+            row['total'] for row in totals}
+
+
+def get_totals(user_ids):
+    """Содержимое таблицы списка покупок в том же виде"""
+    return {(user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.filter(user__in=user_ids).values_list(
+                'user_id', 'ingredient_id', 'amount')}
+
+
+@transaction.atomic
+def apply_deltas(deltas):
+    """Изменение количеств на разницу {(user_id, ingredient_id): delta}.
+       Строки пользователя блокируются, чтобы параллельные изменения
+       одной корзины не потеряли друг друга
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    user_ids = {user_id for user_id, _ in deltas}
+    lock_users(user_ids)
+    items = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.filter(
+            user__in=user_ids,
+            ingredient__in={ingredient_id for _, ingredient_id in deltas})}
+    changed, created, removed = [], [], []
+    for (user_id, ingredient_id), delta in deltas.items():
+        item = items.get((user_id, ingredient_id))
+        if item is None:
+            if delta > 0:
+                created.append(ShoppingListItem(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    amount=delta))
+        elif item.amount + delta > 0:
+            item.amount += delta
+            changed.append(item)
+        else:
+            removed.append(item.pk)
+    if removed:
+        ShoppingListItem.objects.filter(pk__in=removed).delete()
+    if changed:
+        ShoppingListItem.objects.bulk_update(changed, ('amount',))
+    if created:
+        ShoppingListItem.objects.bulk_create(created)
+
+
+def change_carts(user_id, recipe_ids, sign):
+    """Добавление (sign=1) или удаление (sign=-1) рецептов
+       recipe_ids из корзины пользователя
+    """
+    deltas = defaultdict(int)
+    for ingredient_id, amount in IngredientRecipe.objects.filter(
+            recipe__in=recipe_ids).values_list('ingredient_id', 'amount'):
+        deltas[user_id, ingredient_id] += sign * amount
+    apply_deltas(deltas)
+
+
+def change_recipe(recipe_id, changes):
+    """Изменение состава рецепта {ingredient_id: delta}
+       у всех, у кого он в корзине
+    """
+    changes = {
+        ingredient_id: delta for ingredient_id, delta in changes.items()
+        if delta}
+    if not changes:
+        return
+    apply_deltas({
+        (user_id, ingredient_id): delta
+        for user_id in ShoppingCart.objects.filter(
+            recipe=recipe_id).values_list('user_id', flat=True)
+        for ingredient_id, delta in changes.items()})
+
+
+@transaction.atomic
+def rebuild(user_ids):
+    """Пересчёт списка покупок пользователей заново"""
+    ShoppingListItem.objects.filter(user__in=user_ids).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         amount=amount)
+        for (user_id, ingredient_id), amount
+        in compute_totals(user_ids).items())
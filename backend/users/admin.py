@@ -6,7 +6,8 @@ from .models import User
 class UserAdmin(admin.ModelAdmin):
     """Настройки админ панели для модели Пользователей"""
 
-    list_display = ('id', 'first_name', 'last_name', 'email')
+    list_display = ('id', 'first_name', 'last_name', 'email', 'recipes_count',
+                    'followers_count')
     search_fields = ('first_name', 'last_name')
     list_filter = ('first_name', 'email')
 
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_add_counters_to_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_fanout',
+            field=models.BooleanField(default=False, verbose_name='Рассылка рецептов в ленты подписчиков'),
+        ),
+    ]
@@ -13,6 +13,12 @@ class User(AbstractUser):
     first_name = models.CharField(verbose_name='Имя', max_length=150)
     last_name = models.CharField(verbose_name='Фамилия', max_length=150)
     password = models.CharField(verbose_name='Пароль', max_length=150)
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов', default=0)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков', default=0)
+    feed_fanout = models.BooleanField(
+        verbose_name='Рассылка рецептов в ленты подписчиков', default=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']